@@ -0,0 +1,209 @@
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from dairy import billing, db, partitions, rates
+
+# Runs the real data paths against a throwaway database created on a local
+# PostgreSQL server (connection settings come from the usual DAIRY_DB_* vars)
+# and reports throughput and latency percentiles. Usage:
+#
+#   python -m benchmarks.bench_dairy --customers 5000 --days 365 --json run.json
+#   python -m benchmarks.bench_dairy --compare run.json   # exit 1 on p95 regressions
+
+SESSIONS = ("Morning", "Evening")
+ANIMALS = ("Cow", "Buffalo")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def measure(name, fn, iterations, results):
+    latencies = []
+    rows = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        out = fn(i)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        if isinstance(out, (list, tuple)):
+            rows += len(out[0]) if isinstance(out, tuple) else len(out)
+    elapsed = time.perf_counter() - started
+    result = {
+        "name": name, "ops": iterations, "seconds": round(elapsed, 3),
+        "ops_per_sec": round(iterations / elapsed, 1) if elapsed else 0.0,
+        "rows": rows, "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2), "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2) if latencies else 0.0,
+        "mean_ms": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+    }
+    results.append(result)
+    print(f"{name:<24} {result['ops']:>6} ops {result['ops_per_sec']:>9.1f}/s  "
+          f"p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  p99 {result['p99_ms']:>8.2f}  "
+          f"max {result['max_ms']:>8.2f} ms", flush=True)
+    return result
+
+
+def _admin_conn():
+    config = dict(db.DB_CONFIG, dbname=os.environ.get("DAIRY_BENCH_ADMIN_DB", "postgres"))
+    conn = psycopg2.connect(**config)
+    conn.autocommit = True
+    return conn
+
+
+def create_database(name):
+    conn = _admin_conn()
+    try:
+        conn.cursor().execute(f'CREATE DATABASE "{name}"')
+    finally:
+        conn.close()
+
+
+def drop_database(name):
+    conn = _admin_conn()
+    try:
+        conn.cursor().execute(f'DROP DATABASE IF EXISTS "{name}"')
+    finally:
+        conn.close()
+
+
+def generate_data(n_customers, start, days, seed, chart):
+    rng = random.Random(seed)
+    t0 = time.perf_counter()
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        customers = [(f"Farmer {i:05d}", start - timedelta(days=rng.randint(0, 3000)),
+                      f"9{rng.randint(100000000, 999999999)}", f"Village {rng.randint(1, 200)}",
+                      rng.choice(ANIMALS)) for i in range(n_customers)]
+        codes = [r[0] for r in execute_values(
+            cur, "INSERT INTO customers (name, doj, phone, address, animal_type) VALUES %s RETURNING code",
+            customers, page_size=1000, fetch=True)]
+        conn.commit()
+        animals = {code: c[4] for code, c in zip(codes, customers)}
+        # The insert benchmark writes past the generated days too.
+        partitions.ensure_partitions(cur, start, start + timedelta(days=days + 31))
+        fat_steps = int(round((chart.fat_max - chart.fat_min) / chart.fat_step))
+        total = 0
+        for d in range(days):
+            day = start + timedelta(days=d)
+            buf = io.StringIO()
+            for code in codes:
+                for session in SESSIONS:
+                    qty = round(rng.uniform(2.0, 15.0), 1)
+                    fat = round(chart.fat_min + chart.fat_step * rng.randint(0, fat_steps), 1)
+                    rate = chart.lookup(fat) or 0.0
+                    buf.write(f"{code},{day},{session},{animals[code]},{qty},{fat},{rate}\n")
+            buf.seek(0)
+            cur.copy_expert("""COPY milk_collection (customer_code, collection_date, session, animal_type,
+                quantity_liters, fat, rate) FROM STDIN WITH (FORMAT csv)""", buf)
+            conn.commit()
+            total += len(codes) * len(SESSIONS)
+        cur.execute("ANALYZE")
+    print(f"generated {n_customers} customers and {total} collections in {time.perf_counter() - t0:.1f}s",
+          flush=True)
+    return codes
+
+
+def run_benchmarks(codes, start, days, iterations, seed, chart):
+    rng = random.Random(seed + 1)
+    results = []
+    entry_day = start + timedelta(days=days)
+    entry_codes = rng.sample(codes, min(iterations, len(codes)))
+
+    def insert_one(i):
+        fat = round(chart.fat_min + chart.fat_step * rng.randint(0, 20), 1)
+        db.insert_collection(entry_codes[i % len(entry_codes)], entry_day + timedelta(days=i // len(entry_codes)),
+                             "Morning", "Cow", 8.5, fat, chart.lookup(fat) or 0.0)
+
+    def bill(i):
+        begin = start + timedelta(days=rng.randint(0, max(days - 10, 0)))
+        return db.fetch_bill(rng.choice(codes), begin, begin + timedelta(days=9))
+
+    measure("insert_collection", insert_one, iterations, results)
+    measure("fetch_bill (10 days)", bill, iterations, results)
+    measure("fetch_customers_full", lambda i: db.fetch_customers_full(), max(iterations // 20, 3), results)
+    measure("collection load_data", lambda i: db.fetch_recent_collections(50), iterations, results)
+
+    try:
+        import reportlab  # noqa: F401
+    except ImportError:
+        print("reportlab not installed; skipping PDF benchmark")
+        return results
+    with tempfile.TemporaryDirectory() as out_dir:
+        bills = [db.fetch_bill(code, start, start + timedelta(days=9)) for code in rng.sample(codes, 20)]
+
+        def render(i):
+            rows, total = bills[i % len(bills)]
+            billing.render_bill_pdf(os.path.join(out_dir, f"bench_{i}.pdf"), "Bench Farmer", start,
+                                    start + timedelta(days=9), rows, total)
+        measure("PDF bill build", render, max(iterations // 10, 5), results)
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get(r["name"])
+        if base and base["p95_ms"] and r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{r['name']}: p95 {base['p95_ms']:.2f} -> {r['p95_ms']:.2f} ms")
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return not regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dairy data paths on synthetic data.")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365, help="days of morning/evening collections")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2025, 1, 1))
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database afterwards")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline JSON; exit 1 if any p95 regressed beyond --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    dbname = f"dairy_bench_{os.getpid()}"
+    create_database(dbname)
+    db.configure_pool(dbname=dbname)
+    try:
+        db.init_db()
+        chart = rates.load_chart_csv(rates.FAT_RATE_FILE)
+        codes = generate_data(args.customers, args.start, args.days, args.seed, chart)
+        results = run_benchmarks(codes, args.start, args.days, args.iterations, args.seed, chart)
+    finally:
+        db.close_pool()
+        if not args.keep:
+            drop_database(dbname)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"customers": args.customers, "days": args.days, "iterations": args.iterations,
+                       "seed": args.seed, "results": results}, f, indent=2)
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
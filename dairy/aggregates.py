@@ -0,0 +1,163 @@
+from datetime import date
+
+from psycopg2.extras import RealDictCursor
+
+from . import db
+
+# Per customer per day, with session and animal splits, and per day per
+# session/animal across all customers. Both are kept current by a row trigger
+# on milk_collection so reports never scan raw readings.
+SUMMARY_DDL = """
+CREATE TABLE IF NOT EXISTS customer_daily_summary (
+    customer_code INT NOT NULL, collection_date DATE NOT NULL,
+    readings INT NOT NULL DEFAULT 0, liters NUMERIC NOT NULL DEFAULT 0, fat_liters NUMERIC NOT NULL DEFAULT 0,
+    amount NUMERIC NOT NULL DEFAULT 0, morning_liters NUMERIC NOT NULL DEFAULT 0,
+    evening_liters NUMERIC NOT NULL DEFAULT 0, cow_liters NUMERIC NOT NULL DEFAULT 0,
+    buffalo_liters NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (customer_code, collection_date));
+CREATE TABLE IF NOT EXISTS daily_session_summary (
+    collection_date DATE NOT NULL, session TEXT NOT NULL, animal_type TEXT NOT NULL DEFAULT '',
+    readings INT NOT NULL DEFAULT 0, liters NUMERIC NOT NULL DEFAULT 0, fat_liters NUMERIC NOT NULL DEFAULT 0,
+    amount NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (collection_date, session, animal_type));
+CREATE INDEX IF NOT EXISTS idx_milk_collection_date ON milk_collection (collection_date);
+CREATE INDEX IF NOT EXISTS idx_customer_daily_summary_date ON customer_daily_summary (collection_date);
+
+-- Takes the columns rather than a milk_collection row: row triggers fire on
+-- the partitions, whose NEW/OLD carry each partition's own row type.
+DROP FUNCTION IF EXISTS apply_collection_summary(INT, DATE, TEXT, TEXT, FLOAT, FLOAT, FLOAT, INT);
+CREATE OR REPLACE FUNCTION apply_collection_summary(r_customer_code INT, r_collection_date DATE, r_session TEXT,
+    r_animal_type TEXT, r_quantity NUMERIC, r_fat NUMERIC, r_amount NUMERIC, direction INT) RETURNS void AS $$
+DECLARE
+    qty NUMERIC := COALESCE(r_quantity, 0);
+BEGIN
+    INSERT INTO customer_daily_summary AS s (customer_code, collection_date, readings, liters, fat_liters, amount,
+        morning_liters, evening_liters, cow_liters, buffalo_liters)
+    VALUES (r_customer_code, r_collection_date, direction, direction * qty, direction * qty * COALESCE(r_fat, 0),
+        direction * COALESCE(r_amount, 0),
+        CASE WHEN r_session = 'Morning' THEN direction * qty ELSE 0 END,
+        CASE WHEN r_session = 'Evening' THEN direction * qty ELSE 0 END,
+        CASE WHEN r_animal_type = 'Cow' THEN direction * qty ELSE 0 END,
+        CASE WHEN r_animal_type = 'Buffalo' THEN direction * qty ELSE 0 END)
+    ON CONFLICT (customer_code, collection_date) DO UPDATE SET
+        readings = s.readings + EXCLUDED.readings, liters = s.liters + EXCLUDED.liters,
+        fat_liters = s.fat_liters + EXCLUDED.fat_liters, amount = s.amount + EXCLUDED.amount,
+        morning_liters = s.morning_liters + EXCLUDED.morning_liters,
+        evening_liters = s.evening_liters + EXCLUDED.evening_liters,
+        cow_liters = s.cow_liters + EXCLUDED.cow_liters, buffalo_liters = s.buffalo_liters + EXCLUDED.buffalo_liters;
+    DELETE FROM customer_daily_summary
+        WHERE customer_code = r_customer_code AND collection_date = r_collection_date AND readings <= 0;
+
+    INSERT INTO daily_session_summary AS s (collection_date, session, animal_type, readings, liters, fat_liters, amount)
+    VALUES (r_collection_date, r_session, COALESCE(r_animal_type, ''), direction, direction * qty,
+        direction * qty * COALESCE(r_fat, 0), direction * COALESCE(r_amount, 0))
+    ON CONFLICT (collection_date, session, animal_type) DO UPDATE SET
+        readings = s.readings + EXCLUDED.readings, liters = s.liters + EXCLUDED.liters,
+        fat_liters = s.fat_liters + EXCLUDED.fat_liters, amount = s.amount + EXCLUDED.amount;
+    DELETE FROM daily_session_summary
+        WHERE collection_date = r_collection_date AND session = r_session
+        AND animal_type = COALESCE(r_animal_type, '') AND readings <= 0;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION milk_collection_summary_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_collection_summary(OLD.customer_code, OLD.collection_date, OLD.session, OLD.animal_type,
+            OLD.quantity_liters, OLD.fat, OLD.amount, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_collection_summary(NEW.customer_code, NEW.collection_date, NEW.session, NEW.animal_type,
+            NEW.quantity_liters, NEW.fat, NEW.amount, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS milk_collection_summary ON milk_collection;
+CREATE TRIGGER milk_collection_summary AFTER INSERT OR UPDATE OR DELETE ON milk_collection
+    FOR EACH ROW EXECUTE FUNCTION milk_collection_summary_trigger();
+"""
+
+
+def install_summaries(cur):
+    for table in ("customer_daily_summary", "daily_session_summary"):
+        columns = db.float_columns(cur, table)
+        if columns:
+            cur.execute(f"ALTER TABLE {table} " + ", ".join(f"ALTER COLUMN {c} TYPE NUMERIC" for c in columns))
+    cur.execute(SUMMARY_DDL)
+    cur.execute("SELECT EXISTS (SELECT 1 FROM customer_daily_summary)")
+    if not cur.fetchone()[0]:
+        _rebuild(cur)
+
+
+def _rebuild(cur):
+    cur.execute("LOCK TABLE milk_collection IN SHARE MODE")
+    cur.execute("TRUNCATE customer_daily_summary, daily_session_summary")
+    cur.execute("""INSERT INTO customer_daily_summary (customer_code, collection_date, readings, liters, fat_liters,
+            amount, morning_liters, evening_liters, cow_liters, buffalo_liters)
+        SELECT customer_code, collection_date, COUNT(*), SUM(COALESCE(quantity_liters, 0)),
+            SUM(COALESCE(quantity_liters, 0) * COALESCE(fat, 0)), SUM(COALESCE(amount, 0)),
+            SUM(CASE WHEN session = 'Morning' THEN COALESCE(quantity_liters, 0) ELSE 0 END),
+            SUM(CASE WHEN session = 'Evening' THEN COALESCE(quantity_liters, 0) ELSE 0 END),
+            SUM(CASE WHEN animal_type = 'Cow' THEN COALESCE(quantity_liters, 0) ELSE 0 END),
+            SUM(CASE WHEN animal_type = 'Buffalo' THEN COALESCE(quantity_liters, 0) ELSE 0 END)
+        FROM milk_collection GROUP BY customer_code, collection_date""")
+    cur.execute("""INSERT INTO daily_session_summary (collection_date, session, animal_type, readings, liters,
+            fat_liters, amount)
+        SELECT collection_date, session, COALESCE(animal_type, ''), COUNT(*), SUM(COALESCE(quantity_liters, 0)),
+            SUM(COALESCE(quantity_liters, 0) * COALESCE(fat, 0)), SUM(COALESCE(amount, 0))
+        FROM milk_collection GROUP BY collection_date, session, COALESCE(animal_type, '')""")
+
+
+def rebuild_summaries():
+    with db.get_conn() as conn:
+        _rebuild(conn.cursor())
+
+
+def add_avg_fat(row):
+    row["avg_fat"] = row["fat_liters"] / row["liters"] if row["liters"] else 0
+    return row
+
+
+def fetch_customer_totals(cust_code, start_date, end_date):
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT COALESCE(SUM(readings), 0) AS readings, COALESCE(SUM(liters), 0) AS liters,
+            COALESCE(SUM(fat_liters), 0) AS fat_liters, COALESCE(SUM(amount), 0) AS amount,
+            COALESCE(SUM(morning_liters), 0) AS morning_liters, COALESCE(SUM(evening_liters), 0) AS evening_liters,
+            COALESCE(SUM(cow_liters), 0) AS cow_liters, COALESCE(SUM(buffalo_liters), 0) AS buffalo_liters
+            FROM customer_daily_summary WHERE customer_code=%s AND collection_date BETWEEN %s AND %s;""",
+                    (cust_code, start_date, end_date))
+        return add_avg_fat(dict(cur.fetchone()))
+
+
+def fetch_cycle_summary(start_date, end_date):
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT s.customer_code, c.name, SUM(s.readings) AS readings, SUM(s.liters) AS liters,
+            SUM(s.fat_liters) AS fat_liters, SUM(s.amount) AS amount
+            FROM customer_daily_summary s JOIN customers c ON c.code = s.customer_code
+            WHERE s.collection_date BETWEEN %s AND %s
+            GROUP BY s.customer_code, c.name ORDER BY s.customer_code;""", (start_date, end_date))
+        return [add_avg_fat(dict(r)) for r in cur.fetchall()]
+
+
+def fetch_day_totals(start_date, end_date):
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT collection_date, session, animal_type, readings, liters, fat_liters, amount
+            FROM daily_session_summary WHERE collection_date BETWEEN %s AND %s
+            ORDER BY collection_date, session, animal_type;""", (start_date, end_date))
+        return [add_avg_fat(dict(r)) for r in cur.fetchall()]
+
+
+def fetch_dashboard(on_date=None):
+    on_date = on_date or date.today()
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT COALESCE(SUM(readings), 0) AS readings, COALESCE(SUM(liters), 0) AS liters,
+            COALESCE(SUM(fat_liters), 0) AS fat_liters, COALESCE(SUM(amount), 0) AS amount
+            FROM daily_session_summary WHERE collection_date = %s;""", (on_date,))
+        return add_avg_fat(dict(cur.fetchone()))
+
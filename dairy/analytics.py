@@ -0,0 +1,191 @@
+import csv
+import threading
+from datetime import date
+from decimal import Decimal
+
+from psycopg2.extras import RealDictCursor
+
+from . import aggregates, db, metrics
+from .billing import COMPANY_NAME
+
+FAT_BUCKET = 0.5
+TOP_SUPPLIERS = 20
+
+
+# Each report is one set-based query: totals come from the summary tables
+# where they hold the answer, and only the fat histogram reads raw readings.
+def fetch_fat_histogram(start_date, end_date):
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT COALESCE(animal_type, '') AS animal_type, floor(fat / %(width)s) * %(width)s AS fat_from,
+                floor(fat / %(width)s) * %(width)s + %(width)s AS fat_to,
+                COUNT(*) AS readings, SUM(quantity_liters) AS liters, SUM(amount) AS amount
+            FROM milk_collection WHERE collection_date BETWEEN %(start)s AND %(end)s AND fat IS NOT NULL
+            GROUP BY 1, 2, 3 ORDER BY 1, 2;""", {"width": FAT_BUCKET, "start": start_date, "end": end_date})
+        return [dict(r) for r in cur.fetchall()]
+
+
+def fetch_top_suppliers(start_date, end_date, limit=TOP_SUPPLIERS):
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT * FROM (
+                SELECT RANK() OVER (ORDER BY SUM(s.liters) DESC) AS rank, s.customer_code, c.name,
+                    SUM(s.readings) AS readings, SUM(s.liters) AS liters, SUM(s.fat_liters) AS fat_liters,
+                    SUM(s.amount) AS amount, 100 * SUM(s.liters) / NULLIF(SUM(SUM(s.liters)) OVER (), 0) AS share
+                FROM customer_daily_summary s JOIN customers c ON c.code = s.customer_code
+                WHERE s.collection_date BETWEEN %s AND %s GROUP BY s.customer_code, c.name) ranked
+            WHERE rank <= %s ORDER BY rank, customer_code;""", (start_date, end_date, limit))
+        return [aggregates.add_avg_fat(dict(r)) for r in cur.fetchall()]
+
+
+def fetch_daily_trend(start_date, end_date):
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT collection_date, SUM(readings) AS readings, SUM(liters) AS liters,
+                SUM(fat_liters) AS fat_liters, SUM(amount) AS amount,
+                SUM(liters) - LAG(SUM(liters)) OVER w AS liters_change,
+                SUM(amount) - LAG(SUM(amount)) OVER w AS amount_change
+            FROM daily_session_summary WHERE collection_date BETWEEN %s AND %s
+            GROUP BY collection_date WINDOW w AS (ORDER BY collection_date) ORDER BY collection_date;""",
+                    (start_date, end_date))
+        return [aggregates.add_avg_fat(dict(r)) for r in cur.fetchall()]
+
+
+# name -> (title, columns, fetch(start_date, end_date))
+REPORTS = {
+    "cycle": ("Cycle summary by customer", ("customer_code", "name", "readings", "liters", "avg_fat", "amount"),
+              aggregates.fetch_cycle_summary),
+    "days": ("Liters and payout per session / animal",
+             ("collection_date", "session", "animal_type", "readings", "liters", "avg_fat", "amount"),
+             aggregates.fetch_day_totals),
+    "fat": ("Fat distribution", ("animal_type", "fat_from", "fat_to", "readings", "liters", "amount"),
+            fetch_fat_histogram),
+    "top": ("Top suppliers by liters",
+            ("rank", "customer_code", "name", "readings", "liters", "avg_fat", "amount", "share"),
+            fetch_top_suppliers),
+    "trend": ("Day-over-day trend",
+              ("collection_date", "readings", "liters", "avg_fat", "amount", "liters_change", "amount_change"),
+              fetch_daily_trend),
+}
+
+
+class ReportCache:
+    # (report, start, end) -> rows. Changes drop the cached periods they touch
+    # (see collections_changed); a query that was running across an
+    # invalidation is returned but not stored.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._generation = 0
+        self._listeners = []
+
+    def add_listener(self, fn):
+        # fn(dates) after each invalidation; dates is None when everything was dropped.
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def get(self, report, start_date, end_date):
+        key = (report, start_date, end_date)
+        with self._lock:
+            if key in self._rows:
+                return self._rows[key]
+            generation = self._generation
+        with metrics.timer(f"analytics.{report}") as info:
+            rows = REPORTS[report][2](start_date, end_date)
+            info["rows"] = len(rows)
+        with self._lock:
+            if generation == self._generation:
+                self._rows[key] = rows
+        return rows
+
+    def invalidate(self, dates=None):
+        with self._lock:
+            if dates is None:
+                self._rows.clear()
+            else:
+                for key in [k for k in self._rows if covers(k[1], k[2], dates)]:
+                    del self._rows[key]
+            self._generation += 1
+        for fn in list(self._listeners):
+            fn(dates)
+
+
+reports = ReportCache()
+
+
+def covers(start_date, end_date, dates):
+    return dates is None or any(start_date <= d <= end_date for d in dates)
+
+
+def collections_changed(op, ids):
+    # New readings only touch the periods holding their dates. An update may
+    # have moved a reading from a date that is no longer known, and deleted
+    # rows are gone, so those (and reloads, ids None) drop everything.
+    if op != "INSERT" or ids is None:
+        reports.invalidate()
+        return
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT collection_date FROM milk_collection WHERE id = ANY(%s)", (list(ids),))
+        dates = [d for (d,) in cur.fetchall()]
+    if dates:
+        reports.invalidate(dates)
+
+
+def format_value(value):
+    # Money, liters and fat come back as Decimal (or float for computed
+    # columns); dates, counts and names print as they are.
+    if value is None:
+        return ""
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (Decimal, float)):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def write_csv(f, report, rows):
+    columns = REPORTS[report][1]
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    for r in rows:
+        writer.writerow([format_value(r[c]) for c in columns])
+
+
+def write_pdf(path, report, start_date, end_date, rows):
+    # Reports are already aggregated (a few hundred lines at most), so a
+    # platypus table is fine here, unlike the streamed range export.
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    title, columns, _ = REPORTS[report]
+    styles = getSampleStyleSheet()
+    story = [Paragraph(f"<b>{COMPANY_NAME}</b>", styles['Title']),
+             Paragraph(f"{title}: {start_date} to {end_date}", styles['Heading2']), Spacer(1, 12)]
+    table = Table([[c.replace("_", " ").title() for c in columns]] +
+                  [[format_value(r[c]) for c in columns] for r in rows], repeatRows=1)
+    table.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightblue),
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+        ("BACKGROUND", (0, 1), (-1, -1), colors.whitesmoke),
+    ]))
+    story.append(table)
+    SimpleDocTemplate(path, pagesize=landscape(A4)).build(story)
+
+
+def export_report(path, report, start_date, end_date, rows=None):
+    # The format follows the file extension, as for export.export_range.
+    if rows is None:
+        rows = reports.get(report, start_date, end_date)
+    if path.lower().endswith(".pdf"):
+        write_pdf(path, report, start_date, end_date, rows)
+    else:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            write_csv(f, report, rows)
+    return len(rows)
@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import groupby
+
+from psycopg2.extras import RealDictCursor
+
+from . import db
+
+COMPANY_NAME = "Patil Milk Products Pvt. Ltd."
+
+
+def fetch_period_bills(start_date, end_date):
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT m.customer_code, c.name AS customer_name, m.collection_date, m.session,
+            m.animal_type, m.quantity_liters, m.fat, m.rate, m.amount
+            FROM milk_collection m JOIN customers c ON c.code = m.customer_code
+            WHERE m.collection_date BETWEEN %s AND %s
+            ORDER BY m.customer_code, m.collection_date;""", (start_date, end_date))
+        rows = cur.fetchall()
+    bills = []
+    for code, group in groupby(rows, key=lambda r: r["customer_code"]):
+        lines = [dict(r) for r in group]
+        bills.append({"customer_code": code, "customer_name": lines[0]["customer_name"],
+                      "rows": lines, "total": sum(r["amount"] for r in lines)})
+    return bills
+
+
+def bill_filename(customer_name, start_date, end_date, customer_code=None):
+    prefix = f"{customer_code}_" if customer_code is not None else ""
+    return f"Bill_{prefix}{customer_name.replace(' ', '_')}_{start_date}_{end_date}.pdf"
+
+
+# ReportLab is imported inside the render functions so that only code paths
+# which actually produce a PDF pay for loading it.
+def build_bill_story(customer_name, start_date, end_date, rows, total, styles=None):
+    from reportlab.platypus import Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    styles = styles or getSampleStyleSheet()
+    story = []
+
+    # Header
+    story.append(Paragraph(f"<b> {COMPANY_NAME}</b>", styles['Title']))
+    story.append(Paragraph("Milk Bill", styles['Heading2']))
+    story.append(Spacer(1, 12))
+
+    # Customer Info
+    story.append(Paragraph(f"<b>Customer:</b> {customer_name}", styles['Normal']))
+    story.append(Paragraph(f"<b>Bill From:</b> {start_date}  <b>To:</b> {end_date}", styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    # Table
+    data = [["Date", "Session", "Animal", "Qty (L)", "Fat %", "Rate (₹)", "Amount (₹)"]]
+    for r in rows:
+        data.append([
+            str(r["collection_date"]), r["session"], r["animal_type"],
+            f"{r['quantity_liters']:.2f}", f"{r['fat']:.1f}",
+            f"{r['rate']:.2f}", f"{r['amount']:.2f}"
+        ])
+    data.append(["", "", "", "", "", "Total", f"{total:.2f}"])
+
+    table = Table(data, colWidths=[70, 60, 70, 60, 60, 60, 80])
+    table.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightblue),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.black),
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+        ("BACKGROUND", (0, 1), (-1, -1), colors.whitesmoke),
+    ]))
+    story.append(table)
+
+    story.append(Spacer(1, 20))
+    story.append(Paragraph(f"<b>Net Payable Amount:</b> ₹{total:.2f}", styles['Heading2']))
+    return story
+
+
+def render_bill_pdf(filename, customer_name, start_date, end_date, rows, total):
+    from reportlab.platypus import SimpleDocTemplate
+    from reportlab.lib.pagesizes import A4
+
+    doc = SimpleDocTemplate(filename, pagesize=A4)
+    doc.build(build_bill_story(customer_name, start_date, end_date, rows, total))
+    return filename
+
+
+def render_combined_pdf(filename, bills, start_date, end_date):
+    from reportlab.platypus import SimpleDocTemplate, PageBreak
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    styles = getSampleStyleSheet()
+    story = []
+    for i, bill in enumerate(bills):
+        if i:
+            story.append(PageBreak())
+        story.extend(build_bill_story(bill["customer_name"], start_date, end_date,
+                                      bill["rows"], bill["total"], styles))
+    SimpleDocTemplate(filename, pagesize=A4).build(story)
+    return filename
+
+
+def _render_bill_job(filename, bill, start_date, end_date):
+    # Runs in a worker process; only plain dicts cross the process boundary.
+    return render_bill_pdf(filename, bill["customer_name"], start_date, end_date, bill["rows"], bill["total"])
+
+
+def run_bill_batch(start_date, end_date, out_dir=".", combined=False, workers=None, progress=None):
+    # Straight from the readings; ledger.run_bill_batch serves closed cycles from their snapshots.
+    return render_bills(fetch_period_bills(start_date, end_date), start_date, end_date, out_dir, combined,
+                        workers, progress)
+
+
+def render_bills(bills, start_date, end_date, out_dir=".", combined=False, workers=None, progress=None):
+    # bills as returned by fetch_period_bills; returns the PDFs written, sorted.
+    os.makedirs(out_dir, exist_ok=True)
+    if not bills:
+        return []
+    if combined:
+        # A single PDF cannot be split across processes without a merge step,
+        # so the combined statement is built in one pass.
+        filename = os.path.join(out_dir, f"Bills_{start_date}_{end_date}.pdf")
+        render_combined_pdf(filename, bills, start_date, end_date)
+        if progress:
+            progress(len(bills), len(bills), filename)
+        return [filename]
+
+    written = []
+    # Spawned, not forked: the GUI process runs worker, sync and listener
+    # threads whose locks a forked child could inherit held.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_render_bill_job,
+                               os.path.join(out_dir, bill_filename(b["customer_name"], start_date, end_date,
+                                                                   b["customer_code"])),
+                               b, start_date, end_date)
+                   for b in bills]
+        for future in as_completed(futures):
+            written.append(future.result())
+            if progress:
+                progress(len(written), len(bills), written[-1])
+    return sorted(written)
@@ -0,0 +1,122 @@
+import bisect
+import threading
+import time
+
+from psycopg2.extras import RealDictCursor
+
+from . import db
+
+CUSTOMER_COLUMNS = "code, name, doj, phone, address, animal_type, row_version"
+
+
+class CustomerCache:
+    # code -> customer record, plus a sorted lower-case name index. Every
+    # customer write bumps customers.row_version from a sequence, so a refresh
+    # only fetches rows newer than the highest version already held.
+    def __init__(self, check_interval=30.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._by_code = {}
+        self._names = []
+        self._version = None
+        self._checked_at = 0.0
+        self._listeners = []
+
+    def add_listener(self, fn):
+        # fn(changed records, removed codes) is called after refresh_codes, from
+        # the thread that ran it, so one re-read serves every open view.
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    @property
+    def loaded(self):
+        return self._version is not None
+
+    def refresh(self, force=False):
+        # Returns True when the cache changed. Safe to call from worker threads.
+        if not force and self.loaded and time.monotonic() - self._checked_at < self.check_interval:
+            return False
+        with db.get_conn() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            if self.loaded and not force:
+                cur.execute(f"SELECT {CUSTOMER_COLUMNS} FROM customers WHERE row_version > %s ORDER BY code;",
+                            (self._version,))
+                changed = cur.fetchall()
+                cur.execute("SELECT COUNT(*) AS n FROM customers;")
+                count = cur.fetchone()["n"]
+                if count == len(self._by_code) + sum(1 for c in changed if c["code"] not in self._by_code):
+                    self._checked_at = time.monotonic()
+                    if changed:
+                        self._apply(changed, replace=False)
+                    return bool(changed)
+            # First load, forced reload, or a customer was deleted.
+            cur.execute(f"SELECT {CUSTOMER_COLUMNS} FROM customers ORDER BY code;")
+            rows = cur.fetchall()
+        self._checked_at = time.monotonic()
+        self._apply(rows, replace=True)
+        return True
+
+    def _apply(self, rows, replace, removed=()):
+        with self._lock:
+            by_code = {} if replace else dict(self._by_code)
+            for code in removed:
+                by_code.pop(code, None)
+            for r in rows:
+                by_code[r["code"]] = dict(r)
+            versions = [c["row_version"] or 0 for c in by_code.values()]
+            self._version = max(versions, default=0)
+            self._names = sorted((c["name"].lower(), code) for code, c in by_code.items())
+            self._by_code = by_code
+
+    def refresh_codes(self, codes):
+        # Re-reads just these customers (e.g. from a change notification);
+        # returns (changed records, codes that no longer exist).
+        with db.get_conn() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(f"SELECT {CUSTOMER_COLUMNS} FROM customers WHERE code = ANY(%s) ORDER BY code;",
+                        (list(codes),))
+            rows = cur.fetchall()
+        removed = set(codes) - {r["code"] for r in rows}
+        self._apply(rows, replace=False, removed=removed)
+        changed = [dict(r) for r in rows]
+        for fn in list(self._listeners):
+            fn(changed, removed)
+        return changed, removed
+
+    def add(self, record):
+        self._apply([record], replace=False)
+
+    def get(self, code):
+        return self._by_code.get(int(code))
+
+    def name(self, code, default="Unknown"):
+        customer = self.get(code)
+        return customer["name"] if customer else default
+
+    def all(self):
+        return [self._by_code[code] for code in sorted(self._by_code)]
+
+    def search(self, text, limit=20):
+        text = text.strip().lower()
+        if not text:
+            return self.all()[:limit]
+        matches = []
+        if text.isdigit():
+            matches = [c for code, c in sorted(self._by_code.items()) if str(code).startswith(text)][:limit]
+        names = self._names
+        i = bisect.bisect_left(names, (text, -1))
+        while i < len(names) and len(matches) < limit and names[i][0].startswith(text):
+            matches.append(self._by_code[names[i][1]])
+            i += 1
+        return matches
+
+    def insert_customer(self, name, doj, phone, address, animal_type):
+        record = db.insert_customer(name, doj, phone, address, animal_type)
+        self.add(record)
+        return record
+
+
+customers = CustomerCache()
@@ -0,0 +1,112 @@
+import select
+import threading
+
+import psycopg2
+
+from . import db
+
+CHANNEL = "dairy_changes"
+# A statement touching more rows than this is announced as "*" (reload
+# everything) instead of listing keys; NOTIFY payloads are capped at 8000 bytes.
+MAX_KEYS = 200
+
+# One notification per statement, not per row, so a bulk import costs a
+# single NOTIFY. Payload: "<table>:<INSERT|UPDATE|DELETE>:<key,key,...|*>".
+NOTIFY_DDL = """
+CREATE OR REPLACE FUNCTION notify_changes() RETURNS trigger AS $$
+DECLARE
+    n INT;
+    keys TEXT;
+    source TEXT := CASE WHEN TG_OP = 'DELETE' THEN 'old_rows' ELSE 'new_rows' END;
+BEGIN
+    EXECUTE format('SELECT count(*) FROM %I', source) INTO n;
+    IF n = 0 THEN
+        RETURN NULL;
+    ELSIF n > TG_ARGV[1]::INT THEN
+        keys := '*';
+    ELSE
+        EXECUTE format('SELECT string_agg(%I::TEXT, '','') FROM %I', TG_ARGV[0], source) INTO keys;
+    END IF;
+    PERFORM pg_notify('dairy_changes', TG_TABLE_NAME || ':' || TG_OP || ':' || keys);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+NOTIFY_TABLES = {"milk_collection": "id", "customers": "code"}
+_TRANSITIONS = {"INSERT": "NEW TABLE AS new_rows", "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+                "DELETE": "OLD TABLE AS old_rows"}
+
+
+def install_notify(cur):
+    cur.execute(NOTIFY_DDL)
+    # Transition tables allow a single event per trigger, hence three per table.
+    for table, key in NOTIFY_TABLES.items():
+        for op, transition in _TRANSITIONS.items():
+            name = f"{table}_notify_{op.lower()}"
+            cur.execute(f"""DROP TRIGGER IF EXISTS {name} ON {table};
+                CREATE TRIGGER {name} AFTER {op} ON {table} REFERENCING {transition}
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_changes('{key}', '{MAX_KEYS}');""")
+
+
+def parse(payload):
+    # Returns (table, op, keys); keys is None when everything should be reloaded.
+    table, op, keys = payload.split(":", 2)
+    return table, op, None if keys == "*" else [int(k) for k in keys.split(",")]
+
+
+class ChangeFeed:
+    # LISTENs on a dedicated connection (outside the pool, which would hand it
+    # to other work) and calls fn(table, op, keys) for each change. On every
+    # (re)connect listeners get (None, None, None): changes made while the feed
+    # was down were missed, so they reload what they show.
+    def __init__(self, retry=2.0):
+        self.retry = retry
+        self.connected = False
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="dairy-changes", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _emit(self, table, op, keys):
+        for fn in list(self._listeners):
+            fn(table, op, keys)
+
+    def _run(self):
+        backoff = self.retry
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**db.DB_CONFIG)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CHANNEL};")
+                self.connected, backoff = True, self.retry
+                self._emit(None, None, None)
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self._emit(*parse(conn.notifies.pop(0).payload))
+            except (psycopg2.Error, OSError, ValueError):
+                self.connected = False
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if conn is not None:
+                    conn.close()
@@ -0,0 +1,244 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# Subcommand modules are imported inside their handlers so each command only
+# loads what it uses; ReportLab is only pulled in by `bills`.
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, got {value!r}")
+
+
+def cmd_init_db(args):
+    from . import db
+    db.init_db()
+    print("Database schema is up to date")
+
+
+def cmd_import(args):
+    from . import importer
+    status = 0
+    for path in args.files:
+        try:
+            summary = importer.import_collections(path, args.batch_size, args.default_animal)
+        except (OSError, ValueError) as ex:
+            print(f"{path}: {ex}", file=sys.stderr)
+            status = 1
+            continue
+        print(summary.report(limit=50))
+    return status
+
+
+def cmd_bills(args):
+    from . import billing, db, ledger
+
+    def progress(done, total, filename):
+        print(f"[{done}/{total}] {filename}")
+
+    if args.customer is not None:
+        rows, total = ledger.get_bill(args.customer, args.start, args.end)
+        if not rows:
+            print(f"No collections for customer {args.customer} in this period", file=sys.stderr)
+            return 1
+        name = db.get_customer_name(args.customer)
+        os.makedirs(args.out, exist_ok=True)
+        filename = os.path.join(args.out, billing.bill_filename(name, args.start, args.end, args.customer))
+        progress(1, 1, ledger.print_bill(args.customer, name, args.start, args.end, filename, rows, total))
+        return 0
+    files = ledger.run_bill_batch(args.start, args.end, out_dir=args.out, combined=args.combined,
+                                  workers=args.workers, progress=progress)
+    print(f"{len(files)} PDF(s) written to {args.out}")
+    return 0
+
+
+def cmd_export(args):
+    from . import export
+    count, total = export.export_range(args.out, args.start, args.end, args.customer)
+    print(f"{count} collection(s), total {total:.2f}, written to {args.out}")
+    return 0
+
+
+def cmd_publish_chart(args):
+    from . import db, rates
+    db.init_db()
+    chart = rates.load_chart_csv(args.path, animal_type=args.animal, effective_from=args.effective_from,
+                                 effective_to=args.effective_to, interpolate=args.interpolate, name=args.name)
+    chart_id = rates.publish_chart(chart)
+    print(f"Published chart {chart_id}: fat {chart.fat_min:.1f}-{chart.fat_max:.1f}, "
+          f"{chart.snf_count} SNF step(s)")
+    if args.reprice_to:
+        _reprice(args.effective_from, args.reprice_to, args.animal, args.include_manual)
+    return 0
+
+
+def _reprice(start_date, end_date, animal_type, include_manual=False):
+    from . import rates
+    total, changed, unpriced = rates.reprice_period(start_date, end_date, animal_type,
+                                                    include_manual=include_manual)
+    print(f"{total} collections checked, {changed} re-priced, {unpriced} without a matching rate")
+
+
+def cmd_reprice(args):
+    _reprice(args.start, args.end, args.animal, args.include_manual)
+    return 0
+
+
+def cmd_sync(args):
+    from . import journal
+    local = journal.Journal(args.journal)
+    try:
+        synced = problems = 0
+        while True:
+            outcomes = journal.flush(local)
+            if not outcomes:
+                break
+            synced += sum(1 for o in outcomes if o[1] == "synced")
+            for jid, status, _, error in outcomes:
+                if status != "synced":
+                    problems += 1
+                    print(f"journal #{jid}: {status}: {error}", file=sys.stderr)
+        print(f"{synced} collection(s) synced, {problems} need attention")
+        return 1 if problems else 0
+    finally:
+        local.close()
+
+
+def cmd_partitions(args):
+    from . import partitions
+    created = partitions.create_partitions(args.start, args.end)
+    print(f"{len(created)} partition(s) created" + (": " + ", ".join(created) if created else ""))
+    return 0
+
+
+def cmd_archive(args):
+    from . import partitions
+    archived = partitions.archive_partitions(args.before, args.out)
+    for name, rows, path in archived:
+        print(f"{name}: {rows} row(s) -> {path}")
+    print(f"{len(archived)} partition(s) archived")
+    return 0
+
+
+def cmd_restore(args):
+    from . import partitions
+    for path in args.files:
+        name, rows = partitions.restore_partition(path)
+        print(f"{name}: {rows} row(s) restored")
+    return 0
+
+
+def cmd_rebuild_summaries(args):
+    from . import aggregates
+    aggregates.rebuild_summaries()
+    print("Summary tables rebuilt")
+    return 0
+
+
+def cmd_report(args):
+    from . import analytics
+    if not args.out:
+        analytics.write_csv(sys.stdout, args.report, analytics.reports.get(args.report, args.start, args.end))
+        return 0
+    count = analytics.export_report(args.out, args.report, args.start, args.end)
+    print(f"{count} row(s) written to {args.out}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="dairy", description="Modern Dairy Manager command line tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("init-db", help="create or upgrade the database schema")
+    p.set_defaults(func=cmd_init_db)
+
+    p = sub.add_parser("import", help="bulk import collection readings from CSV day files")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--batch-size", type=int, default=500)
+    p.add_argument("--default-animal", default="Cow", choices=["Cow", "Buffalo"])
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("bills", help="render bill PDFs for a period")
+    p.add_argument("start", type=_date)
+    p.add_argument("end", type=_date)
+    p.add_argument("--customer", type=int, help="bill one customer instead of everyone")
+    p.add_argument("--out", default=".", help="output folder")
+    p.add_argument("--combined", action="store_true", help="write a single combined PDF")
+    p.add_argument("--workers", type=int, help="render processes (default: CPU count)")
+    p.set_defaults(func=cmd_bills)
+
+    p = sub.add_parser("export", help="stream a period's collections to a CSV or PDF statement")
+    p.add_argument("start", type=_date)
+    p.add_argument("end", type=_date)
+    p.add_argument("out", help="output file; .pdf for a statement, anything else for CSV")
+    p.add_argument("--customer", type=int, help="export one customer instead of everyone")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("publish-chart", help="publish a Fat,Rate or Fat,SNF,Rate chart CSV")
+    p.add_argument("path")
+    p.add_argument("--animal", choices=["Cow", "Buffalo"])
+    p.add_argument("--from", dest="effective_from", type=_date)
+    p.add_argument("--to", dest="effective_to", type=_date)
+    p.add_argument("--name", default="")
+    p.add_argument("--interpolate", action="store_true")
+    p.add_argument("--reprice-to", type=_date,
+                   help="re-price collections from the chart's effective date up to this date")
+    p.add_argument("--include-manual", action="store_true", help="also re-price hand-entered, imported and pre-chart rates")
+    p.set_defaults(func=cmd_publish_chart)
+
+    p = sub.add_parser("reprice", help="re-price a period with the current rate charts")
+    p.add_argument("start", type=_date)
+    p.add_argument("end", type=_date)
+    p.add_argument("--animal", choices=["Cow", "Buffalo"])
+    p.add_argument("--include-manual", action="store_true", help="also re-price hand-entered, imported and pre-chart rates")
+    p.set_defaults(func=cmd_reprice)
+
+    p = sub.add_parser("sync", help="push collections waiting in the local journal to the server")
+    p.add_argument("--journal", default=os.environ.get("DAIRY_JOURNAL", "collection_journal.db"))
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("partitions", help="create milk_collection partitions ahead of time")
+    p.add_argument("--from", dest="start", type=_date, help="first date to cover (default: today)")
+    p.add_argument("--to", dest="end", type=_date, help="last date to cover (default: three months ahead)")
+    p.set_defaults(func=cmd_partitions)
+
+    p = sub.add_parser("archive", help="detach closed partitions and write them out as .csv.gz")
+    p.add_argument("before", type=_date, help="archive partitions ending on or before this date")
+    p.add_argument("--out", default="archive", help="output folder")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("restore", help="re-attach partitions from archive files")
+    p.add_argument("files", nargs="+")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser("rebuild-summaries", help="recompute the summary tables from milk_collection")
+    p.set_defaults(func=cmd_rebuild_summaries)
+
+    p = sub.add_parser("report", help="export an analytics report as CSV or PDF")
+    p.add_argument("report", choices=["cycle", "days", "fat", "top", "trend"])
+    p.add_argument("start", type=_date)
+    p.add_argument("end", type=_date)
+    p.add_argument("--out", "--csv", dest="out", help="output file; .pdf for a PDF, anything else for CSV "
+                                                    "(default: CSV on stdout)")
+    p.set_defaults(func=cmd_report)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "reprice_to", None) and not args.effective_from:
+        parser.error("--reprice-to needs --from")
+    import psycopg2
+    from . import db
+    try:
+        return args.func(args) or 0
+    except (OSError, ValueError, psycopg2.Error) as ex:
+        print(ex, file=sys.stderr)
+        return 1
+    finally:
+        db.close_pool()
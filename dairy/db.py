@@ -0,0 +1,369 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from . import metrics
+
+
+DB_CONFIG = {
+    "host": os.environ.get("DAIRY_DB_HOST", "localhost"),
+    "port": int(os.environ.get("DAIRY_DB_PORT", "5432")),
+    "dbname": os.environ.get("DAIRY_DB_NAME", "dairy_management"),
+    "user": os.environ.get("DAIRY_DB_USER", "postgres"),
+    "password": os.environ.get("DAIRY_DB_PASSWORD", "system"),
+    "connect_timeout": int(os.environ.get("DAIRY_DB_CONNECT_TIMEOUT", "5")),
+}
+POOL_MIN = int(os.environ.get("DAIRY_DB_POOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("DAIRY_DB_POOL_MAX", "5"))
+CUSTOMER_PAGE = 200
+# A pooled connection idle for longer than this is pinged before being handed out.
+HEALTH_CHECK_AFTER = float(os.environ.get("DAIRY_DB_HEALTH_CHECK_SECS", "30"))
+
+# Quantities and money are exact NUMERICs and amount is computed by the server.
+MONEY_MIGRATION = """
+ALTER TABLE milk_collection
+    ALTER COLUMN quantity_liters TYPE NUMERIC(10,2) USING round(quantity_liters::NUMERIC, 2),
+    ALTER COLUMN fat TYPE NUMERIC(5,2) USING round(fat::NUMERIC, 2),
+    ALTER COLUMN snf TYPE NUMERIC(5,2) USING round(snf::NUMERIC, 2),
+    ALTER COLUMN rate TYPE NUMERIC(10,2) USING round(rate::NUMERIC, 2),
+    DROP COLUMN amount,
+    ADD COLUMN amount NUMERIC(12,2) GENERATED ALWAYS AS (round(quantity_liters * rate, 2)) STORED;
+"""
+COLLECTION_COLUMNS = ("id, customer_code, collection_date, session, animal_type, quantity_liters, fat, rate, "
+                      "snf, rate_chart, amount")
+
+# Hot single-row writes run as server-side prepared statements, prepared once
+# per pooled connection. Explicit column lists keep the result type stable.
+PREPARED = {
+    "insert_collection": f"""INSERT INTO milk_collection (customer_code, collection_date, session, animal_type,
+        quantity_liters, fat, rate, rate_chart) VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+        ON CONFLICT ON CONSTRAINT unique_collection DO NOTHING RETURNING {COLLECTION_COLUMNS}""",
+    "update_collection": f"""UPDATE milk_collection SET customer_code=$1, collection_date=$2, session=$3,
+        animal_type=$4, quantity_liters=$5, fat=$6, rate=$7,
+        rate_chart=COALESCE($8, rate_chart) WHERE id=$9
+        RETURNING {COLLECTION_COLUMNS}""",
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(POOL_MAX)
+_last_used = {}
+
+
+def configure_pool(minconn=None, maxconn=None, **db_config):
+    global POOL_MIN, POOL_MAX, _slots
+    close_pool()
+    if minconn is not None:
+        POOL_MIN = minconn
+    if maxconn is not None:
+        POOL_MAX = maxconn
+    DB_CONFIG.update(db_config)
+    _slots = threading.BoundedSemaphore(POOL_MAX)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(POOL_MIN, POOL_MAX, connection_factory=metrics.InstrumentedConnection,
+                                           **DB_CONFIG)
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+        _last_used.clear()
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < HEALTH_CHECK_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout(pool):
+    # One retry per pooled connection: after a server restart every idle
+    # connection is dead, and each failed ping drops one from the pool.
+    for _ in range(POOL_MAX + 1):
+        conn = pool.getconn()
+        if _is_healthy(conn):
+            return conn
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("could not obtain a healthy database connection")
+
+
+@contextmanager
+def get_conn():
+    # Blocks instead of raising PoolError when every connection is checked out.
+    slots = _slots
+    with metrics.timer("db.checkout"):
+        slots.acquire()
+        try:
+            pool = get_pool()
+            conn = _checkout(pool)
+        except BaseException:
+            slots.release()
+            raise
+    try:
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            broken = broken or bool(conn.closed)
+            if broken:
+                _last_used.pop(id(conn), None)
+            else:
+                _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=broken)
+    finally:
+        slots.release()
+
+
+def execute_prepared(cur, name, params):
+    # Prepared statements outlive transactions (even rolled back ones) and
+    # vanish with the connection, so the names are remembered on it.
+    conn = cur.connection
+    prepared = getattr(conn, "prepared", None)
+    if prepared is None:
+        prepared = conn.prepared = set()
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {PREPARED[name]}")
+        prepared.add(name)
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
+def float_columns(cur, table):
+    cur.execute("""SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema()
+        AND table_name = %s AND data_type = 'double precision'""", (table,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def init_db():
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""CREATE TABLE IF NOT EXISTS customers (
+            code SERIAL PRIMARY KEY, name TEXT NOT NULL, doj DATE, phone TEXT, address TEXT, animal_type TEXT);""")
+        from . import aggregates, changes, ledger, partitions  # import db; deferred to avoid a cycle
+        partitions.install(cur)
+        cur.execute("ALTER TABLE milk_collection ADD COLUMN IF NOT EXISTS snf NUMERIC(5,2);")
+        # Which chart version priced each reading (rates.RateChart.version, or rates.MANUAL_RATE).
+        cur.execute("ALTER TABLE milk_collection ADD COLUMN IF NOT EXISTS rate_chart TEXT;")
+        if "amount" in float_columns(cur, "milk_collection"):
+            cur.execute(MONEY_MIGRATION)
+        # customers.row_version lets the customer cache fetch only rows changed since its last refresh.
+        cur.execute("""CREATE SEQUENCE IF NOT EXISTS customers_row_version_seq;
+            ALTER TABLE customers ADD COLUMN IF NOT EXISTS row_version BIGINT;
+            UPDATE customers SET row_version = nextval('customers_row_version_seq') WHERE row_version IS NULL;
+            ALTER TABLE customers ALTER COLUMN row_version SET DEFAULT nextval('customers_row_version_seq');
+            CREATE INDEX IF NOT EXISTS idx_customers_row_version ON customers (row_version);
+            CREATE OR REPLACE FUNCTION bump_customer_row_version() RETURNS trigger AS $$
+            BEGIN
+                NEW.row_version := nextval('customers_row_version_seq');
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            DROP TRIGGER IF EXISTS customers_row_version ON customers;
+            CREATE TRIGGER customers_row_version BEFORE UPDATE ON customers
+                FOR EACH ROW EXECUTE FUNCTION bump_customer_row_version();""")
+        cur.execute("""CREATE TABLE IF NOT EXISTS rate_charts (
+            id SERIAL PRIMARY KEY, name TEXT, animal_type TEXT, effective_from DATE, effective_to DATE,
+            fat_min FLOAT NOT NULL, fat_step FLOAT NOT NULL, fat_count INT NOT NULL,
+            snf_min FLOAT, snf_step FLOAT, snf_count INT NOT NULL DEFAULT 1,
+            interpolate BOOLEAN NOT NULL DEFAULT FALSE, rates FLOAT[] NOT NULL,
+            published_at TIMESTAMP NOT NULL DEFAULT now());""")
+        # Trigram indexes serve substring search on name and phone. pg_trgm ships
+        # in contrib and needs CREATE privilege; without it search still works
+        # but scans the table.
+        cur.execute("SAVEPOINT customer_search")
+        try:
+            cur.execute("""CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                CREATE INDEX IF NOT EXISTS idx_customers_name_trgm ON customers USING gin (name gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_customers_phone_trgm ON customers USING gin (phone gin_trgm_ops);""")
+        except psycopg2.Error:
+            cur.execute("ROLLBACK TO SAVEPOINT customer_search")
+        aggregates.install_summaries(cur)
+        ledger.install(cur)
+        changes.install_notify(cur)
+        cur.close()
+
+
+@metrics.timed("db.insert_customer")
+def insert_customer(name, doj, phone, address, animal_type):
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""INSERT INTO customers (name, doj, phone, address, animal_type) VALUES (%s,%s,%s,%s,%s)
+            RETURNING code, name, doj, phone, address, animal_type, row_version""",
+                    (name, doj, phone, address, animal_type))
+        return cur.fetchone()
+
+
+@metrics.timed("db.fetch_customers")
+def fetch_customers():
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT code, name FROM customers ORDER BY code;")
+        return cur.fetchall()
+
+
+@metrics.timed("db.fetch_customers_full")
+def fetch_customers_full():
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT code, name, doj, phone, address, animal_type FROM customers ORDER BY code;")
+        return cur.fetchall()
+
+
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _customer_filter(text):
+    # Name or phone containing the text, or the exact code when it is a number.
+    # Kept to OR-ed indexable terms so the planner can combine index scans.
+    text = text.strip()
+    if not text:
+        return "", []
+    like = "%" + _like_escape(text) + "%"
+    sql, params = "name ILIKE %s OR phone LIKE %s", [like, like]
+    if text.isdigit():
+        sql, params = sql + " OR code = %s", params + [int(text)]
+    return f" AND ({sql})", params
+
+
+@metrics.timed("db.fetch_customer_page")
+def fetch_customer_page(after_code=0, search="", limit=CUSTOMER_PAGE):
+    # Keyset pagination: the next page starts after the last code already shown.
+    where, params = _customer_filter(search)
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(f"""SELECT code, name, doj, phone, address, animal_type FROM customers
+            WHERE code > %s{where} ORDER BY code LIMIT %s;""", [after_code] + params + [limit])
+        return cur.fetchall()
+
+
+@metrics.timed("db.get_customer_name")
+def get_customer_name(code):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name FROM customers WHERE code = %s", (code,))
+        name = cur.fetchone()
+        return name[0] if name else "Unknown"
+
+
+@metrics.timed("db.insert_collection")
+def insert_collection(cust_code, collection_date, session, animal_type, qty, fat, rate, rate_chart=None):
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        execute_prepared(cur, "insert_collection",
+                         (cust_code, collection_date, session, animal_type, qty, fat, rate, rate_chart))
+        row = cur.fetchone()
+        if row is None:
+            raise Exception(f"{session} entry already exists for this customer on {collection_date}")
+        return row
+
+
+def insert_collections(cur, records):
+    # records are (customer_code, collection_date, session, animal_type, qty, fat, rate, rate_chart)
+    # tuples. Returns ({(customer_code, collection_date, session): id} for rows actually
+    # inserted, set of customer codes that exist); duplicates are skipped by unique_collection.
+    cur.execute("SELECT code FROM customers WHERE code = ANY(%s)", (list({r[0] for r in records}),))
+    known = {code for (code,) in cur.fetchall()}
+    valid = [r for r in records if r[0] in known]
+    if not valid:
+        return {}, known
+    returned = execute_values(cur, """INSERT INTO milk_collection (customer_code, collection_date, session,
+        animal_type, quantity_liters, fat, rate, rate_chart) VALUES %s
+        ON CONFLICT ON CONSTRAINT unique_collection DO NOTHING
+        RETURNING id, customer_code, collection_date, session""", valid, page_size=len(valid), fetch=True)
+    return {(c, d, s): i for i, c, d, s in returned}, known
+
+
+def insert_collections_each(cur, records):
+    # Row-by-row fallback for a batch the server refused as a whole; returns
+    # (inserted, known, {record index: error}) with the failing rows left out.
+    inserted, known, failed = {}, set(), {}
+    for i, rec in enumerate(records):
+        cur.execute("SAVEPOINT collection_row")
+        try:
+            row_inserted, row_known = insert_collections(cur, [rec])
+        except (psycopg2.DataError, psycopg2.IntegrityError) as ex:
+            cur.execute("ROLLBACK TO SAVEPOINT collection_row")
+            failed[i] = str(ex).strip()
+            continue
+        cur.execute("RELEASE SAVEPOINT collection_row")
+        inserted.update(row_inserted)
+        known |= row_known
+    return inserted, known, failed
+
+
+@metrics.timed("db.fetch_recent_collections")
+def fetch_recent_collections(limit=50):
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT * FROM milk_collection ORDER BY id DESC LIMIT %s;", (limit,))
+        return cur.fetchall()
+
+
+@metrics.timed("db.fetch_collections")
+def fetch_collections(ids):
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT * FROM milk_collection WHERE id = ANY(%s) ORDER BY id DESC;", (list(ids),))
+        return cur.fetchall()
+
+
+@metrics.timed("db.update_collection")
+def update_collection(collection_id, cust_code, collection_date, session, animal_type, qty, fat, rate,
+                      rate_chart=None):
+    # Returns the updated row, or None if it was deleted meanwhile. rate_chart=None keeps the recorded one.
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        execute_prepared(cur, "update_collection",
+                         (cust_code, collection_date, session, animal_type, qty, fat, rate, rate_chart, collection_id))
+        return cur.fetchone()
+
+
+@metrics.timed("db.delete_collection")
+def delete_collection(collection_id):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM milk_collection WHERE id=%s RETURNING id", (collection_id,))
+        return cur.fetchone() is not None
+
+
+@metrics.timed("db.fetch_bill")
+def fetch_bill(cust_code, start_date, end_date):
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT collection_date, session, animal_type, quantity_liters, fat, rate, amount
+            FROM milk_collection WHERE customer_code=%s AND collection_date BETWEEN %s AND %s
+            ORDER BY collection_date;""", (cust_code, start_date, end_date))
+        rows = cur.fetchall()
+        total = sum(r["amount"] for r in rows)
+        return rows, total
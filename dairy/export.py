@@ -0,0 +1,145 @@
+import csv
+
+from . import db
+from .billing import COMPANY_NAME
+
+FETCH_SIZE = 2000
+EXPORT_COLUMNS = ("customer_code", "customer_name", "collection_date", "session", "animal_type",
+                  "quantity_liters", "fat", "rate", "amount")
+
+
+# Exports read through a server-side (named) cursor a chunk at a time and
+# write each chunk before fetching the next, so memory stays flat no matter
+# how long the range is.
+def stream_collections(start_date, end_date, customer_code=None, fetch_size=FETCH_SIZE):
+    sql = """SELECT m.customer_code, c.name, m.collection_date, m.session, m.animal_type,
+        m.quantity_liters, m.fat, m.rate, m.amount
+        FROM milk_collection m JOIN customers c ON c.code = m.customer_code
+        WHERE m.collection_date BETWEEN %s AND %s"""
+    params = [start_date, end_date]
+    if customer_code is not None:
+        sql += " AND m.customer_code = %s"
+        params.append(customer_code)
+    sql += " ORDER BY m.customer_code, m.collection_date, m.session"
+    with db.get_conn() as conn:
+        with conn.cursor(name="dairy_export") as cur:
+            cur.itersize = fetch_size
+            cur.execute(sql, params)
+            while True:
+                chunk = cur.fetchmany(fetch_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def export_csv(path, start_date, end_date, customer_code=None, progress=None):
+    count = 0
+    total = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        for chunk in stream_collections(start_date, end_date, customer_code):
+            writer.writerows(chunk)
+            count += len(chunk)
+            total += sum(r[8] for r in chunk)
+            if progress:
+                progress(count)
+    return count, total
+
+
+# Drawn straight onto a canvas page by page: a platypus story would hold every
+# row (and its table layout) in memory until the whole document is built.
+PDF_HEADINGS = ("Date", "Session", "Animal", "Qty (L)", "Fat %", "Rate", "Amount")
+PDF_COLUMNS = (60, 140, 210, 300, 360, 420, 500)
+ROW_HEIGHT = 15
+
+
+class _StatementCanvas:
+    def __init__(self, path, start_date, end_date):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+
+        self.canvas = canvas.Canvas(path, pagesize=A4, pageCompression=1)
+        self.width, self.height = A4
+        self.period = f"Bill From: {start_date}  To: {end_date}"
+        self.y = 0
+        self.page_open = False
+
+    def start_customer(self, code, name):
+        if self.page_open:
+            self.canvas.showPage()
+        self.customer = f"Customer: {code} - {name}"
+        self._header()
+
+    def _header(self):
+        c = self.canvas
+        top = self.height - 50
+        c.setFont("Helvetica-Bold", 16)
+        c.drawCentredString(self.width / 2, top, COMPANY_NAME)
+        c.setFont("Helvetica-Bold", 12)
+        c.drawCentredString(self.width / 2, top - 20, "Milk Bill")
+        c.setFont("Helvetica", 10)
+        c.drawString(PDF_COLUMNS[0], top - 45, self.customer)
+        c.drawString(PDF_COLUMNS[0], top - 60, self.period)
+        self.y = top - 85
+        c.setFont("Helvetica-Bold", 10)
+        self._line(PDF_HEADINGS)
+        c.setFont("Helvetica", 10)
+        self.page_open = True
+
+    def _line(self, values):
+        for x, value in zip(PDF_COLUMNS, values):
+            self.canvas.drawString(x, self.y, value)
+        self.y -= ROW_HEIGHT
+
+    def row(self, r):
+        if self.y < 60:
+            self.canvas.showPage()
+            self._header()
+        self._line((str(r[2]), r[3], r[4] or "", f"{r[5]:.2f}", f"{r[6]:.1f}", f"{r[7]:.2f}", f"{r[8]:.2f}"))
+
+    def total(self, label, amount):
+        if self.y < 75:
+            self.canvas.showPage()
+            self._header()
+        self.y -= 5
+        self.canvas.setFont("Helvetica-Bold", 11)
+        self.canvas.drawString(PDF_COLUMNS[0], self.y, f"{label}: {amount:.2f}")
+        self.canvas.setFont("Helvetica", 10)
+        self.y -= ROW_HEIGHT
+
+    def save(self):
+        self.canvas.save()
+
+
+def export_pdf(path, start_date, end_date, customer_code=None, progress=None):
+    doc = _StatementCanvas(path, start_date, end_date)
+    count = 0
+    total = subtotal = 0
+    current = None
+    for chunk in stream_collections(start_date, end_date, customer_code):
+        for r in chunk:
+            if r[0] != current:
+                if current is not None:
+                    doc.total("Net Payable Amount", subtotal)
+                current, subtotal = r[0], 0
+                doc.start_customer(r[0], r[1])
+            doc.row(r)
+            subtotal += r[8]
+            total += r[8]
+        count += len(chunk)
+        if progress:
+            progress(count)
+    if current is not None:
+        doc.total("Net Payable Amount", subtotal)
+        if customer_code is None:
+            doc.total("Total for all customers", total)
+    doc.save()
+    return count, total
+
+
+def export_range(path, start_date, end_date, customer_code=None, progress=None):
+    # The format follows the file extension.
+    if path.lower().endswith(".pdf"):
+        return export_pdf(path, start_date, end_date, customer_code, progress)
+    return export_csv(path, start_date, end_date, customer_code, progress)
@@ -0,0 +1,181 @@
+import csv
+from datetime import date, datetime, timedelta
+
+import psycopg2
+
+from . import db, journal, partitions, rates
+
+BATCH_SIZE = 500
+
+# Header spellings seen in analyzer and satellite-centre day files.
+COLUMN_ALIASES = {
+    "customer_code": ("customer_code", "code", "customer", "member", "member_code", "farmer_code"),
+    "collection_date": ("collection_date", "date"),
+    "session": ("session", "shift"),
+    "animal_type": ("animal_type", "animal", "milk_type", "type"),
+    "quantity_liters": ("quantity_liters", "quantity", "qty", "liters", "litres"),
+    "fat": ("fat", "fat%", "fat_percent"),
+    "rate": ("rate",),
+}
+REQUIRED_COLUMNS = ("customer_code", "collection_date", "session", "quantity_liters", "fat")
+SESSION_ALIASES = {"m": "Morning", "am": "Morning", "morning": "Morning",
+                   "e": "Evening", "pm": "Evening", "evening": "Evening"}
+ANIMAL_ALIASES = {"c": "Cow", "cow": "Cow", "b": "Buffalo", "buf": "Buffalo", "buffalo": "Buffalo"}
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y")
+# Day files are back-dated by weeks at most; anything older (or in the
+# future) is a mistyped date, not a reading.
+MAX_AGE_DAYS = 366
+
+
+class ImportSummary:
+    def __init__(self, source):
+        self.source = source
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = []
+        self.rejects = []
+
+    def report(self, limit=10):
+        lines = [f"{self.source}: {self.read} read, {self.inserted} inserted, "
+                 f"{len(self.duplicates)} duplicates, {len(self.rejects)} rejected"]
+        for line_no, reason in (self.duplicates + self.rejects)[:limit]:
+            lines.append(f"  line {line_no}: {reason}")
+        if len(self.duplicates) + len(self.rejects) > limit:
+            lines.append(f"  ... and {len(self.duplicates) + len(self.rejects) - limit} more")
+        return "\n".join(lines)
+
+
+def _column_map(fieldnames):
+    normalised = {name.strip().lower().replace(' ', '_'): name for name in fieldnames or []}
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalised:
+                columns[column] = normalised[alias]
+                break
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise ValueError(f"CSV is missing column(s): {', '.join(missing)}")
+    return columns
+
+
+def _parse_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"unrecognised date {value!r}")
+
+
+def parse_row(row, columns, default_animal="Cow"):
+    # rate and rate_chart are None when the file has no rate; _price_batch fills them in.
+    try:
+        cust_code = int(row[columns["customer_code"]])
+    except ValueError:
+        raise ValueError(f"invalid customer code {row[columns['customer_code']]!r}")
+    collection_date = _parse_date(row[columns["collection_date"]])
+    today = date.today()
+    if not today - timedelta(days=MAX_AGE_DAYS) <= collection_date <= today:
+        raise ValueError(f"date {collection_date} is in the future or more than {MAX_AGE_DAYS} days old")
+    session = SESSION_ALIASES.get(row[columns["session"]].strip().lower())
+    if session is None:
+        raise ValueError(f"unknown session {row[columns['session']]!r}")
+    animal_type = default_animal
+    if "animal_type" in columns and row[columns["animal_type"]].strip():
+        animal_type = ANIMAL_ALIASES.get(row[columns["animal_type"]].strip().lower())
+        if animal_type is None:
+            raise ValueError(f"unknown animal type {row[columns['animal_type']]!r}")
+    try:
+        qty = float(row[columns["quantity_liters"]])
+        fat = float(row[columns["fat"]])
+    except ValueError:
+        raise ValueError("quantity and fat must be numbers")
+    rate = rate_chart = None
+    if "rate" in columns and row[columns["rate"]].strip():
+        rate, rate_chart = float(row[columns["rate"]]), rates.MANUAL_RATE
+    # Same limits as entry at the counter: "nan" parses as a float, and values
+    # too large for the NUMERIC columns would fail the whole batch.
+    journal.check_reading(qty, fat, rate)
+    return (cust_code, collection_date, session, animal_type, qty, fat, rate, rate_chart)
+
+
+def _price_batch(batch, summary):
+    # Rows without a rate are priced together, chart by chart; rows no chart
+    # prices are rejected. Returns the batch that can be loaded.
+    todo = [i for i, (_, r) in enumerate(batch) if r[6] is None]
+    if not todo:
+        return batch
+    book = rates.rate_book
+    if book is None:
+        prices, charts = [None] * len(todo), [None] * len(todo)
+    else:
+        prices, charts = book.price_readings((batch[i][1][3], batch[i][1][1], batch[i][1][5], None) for i in todo)
+    unpriced = set()
+    batch = list(batch)
+    for i, rate, chart in zip(todo, prices, charts):
+        line_no, r = batch[i]
+        if rate is None:
+            reason = (f"no rate for fat {r[5]} in {chart.label}" if chart is not None
+                      else f"no rate chart for {r[3]} on {r[1]}")
+            summary.rejects.append((line_no, reason))
+            unpriced.add(i)
+        else:
+            batch[i] = (line_no, r[:6] + (rate, chart.version))
+    return [b for i, b in enumerate(batch) if i not in unpriced]
+
+
+def _load_batch(conn, batch, summary):
+    batch = _price_batch(batch, summary)
+    if not batch:
+        return
+    cur = conn.cursor()
+    # Back-dated day files would otherwise pile up in the default partition.
+    partitions.ensure_partitions_for(cur, {r[1] for _, r in batch})
+    records = [r for _, r in batch]
+    cur.execute("SAVEPOINT import_batch")
+    try:
+        inserted, known = db.insert_collections(cur, records)
+        failed = {}
+    except (psycopg2.DataError, psycopg2.IntegrityError):
+        # A row the server refuses is rejected on its own; the rest of the batch still loads.
+        cur.execute("ROLLBACK TO SAVEPOINT import_batch")
+        inserted, known, failed = db.insert_collections_each(cur, records)
+    for i, (line_no, record) in enumerate(batch):
+        if i in failed:
+            summary.rejects.append((line_no, failed[i]))
+        elif record[0] not in known:
+            summary.rejects.append((line_no, f"unknown customer code {record[0]}"))
+        elif inserted.pop(record[:3], None) is not None:
+            summary.inserted += 1
+        else:
+            summary.duplicates.append((line_no, f"{record[2]} entry for customer {record[0]} on {record[1]} "
+                                                f"already exists"))
+    conn.commit()
+
+
+def import_collections(path, batch_size=BATCH_SIZE, default_animal="Cow"):
+    try:
+        rates.ensure_loaded()
+    except FileNotFoundError:
+        pass
+    summary = ImportSummary(path)
+    with open(path, newline='', encoding='utf-8-sig') as file, db.get_conn() as conn:
+        reader = csv.DictReader(file)
+        columns = _column_map(reader.fieldnames)
+        batch = []
+        for row in reader:
+            summary.read += 1
+            line_no = reader.line_num
+            try:
+                batch.append((line_no, parse_row(row, columns, default_animal)))
+            except (ValueError, TypeError, KeyError, AttributeError) as ex:
+                summary.rejects.append((line_no, str(ex)))
+            if len(batch) >= batch_size:
+                _load_batch(conn, batch, summary)
+                batch = []
+        if batch:
+            _load_batch(conn, batch, summary)
+    summary.rejects.sort()
+    return summary
+
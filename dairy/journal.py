@@ -0,0 +1,197 @@
+import math
+import os
+import sqlite3
+import threading
+from datetime import date
+
+import psycopg2
+
+from . import db, metrics
+
+JOURNAL_FILE = os.environ.get("DAIRY_JOURNAL", "collection_journal.db")
+SYNC_INTERVAL = float(os.environ.get("DAIRY_SYNC_INTERVAL", "2"))
+SYNC_BATCH = 200
+PURGE_SYNCED_DAYS = 30
+# Sanity limits checked before a reading is journaled or imported; all well inside the NUMERIC columns.
+MAX_QUANTITY = 10000.0
+MAX_FAT = 20.0
+MAX_RATE = 10000.0
+
+# Collections are committed to this local SQLite file first, so entry at the
+# counter never waits on PostgreSQL; the Syncer drains it in batches.
+JOURNAL_DDL = """
+CREATE TABLE IF NOT EXISTS pending_collections (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, customer_code INTEGER NOT NULL, collection_date TEXT NOT NULL,
+    session TEXT NOT NULL, animal_type TEXT, quantity_liters REAL NOT NULL, fat REAL NOT NULL, rate REAL NOT NULL,
+    rate_chart TEXT, created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP, status TEXT NOT NULL DEFAULT 'pending',
+    server_id INTEGER, error TEXT, synced_at TEXT);
+CREATE INDEX IF NOT EXISTS idx_pending_status ON pending_collections (status, id);
+CREATE INDEX IF NOT EXISTS idx_pending_key ON pending_collections (customer_code, collection_date, session);
+"""
+
+
+class Journal:
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(JOURNAL_DDL)
+        columns = {r[1] for r in self._conn.execute("PRAGMA table_info(pending_collections)")}
+        if "rate_chart" not in columns:
+            self._conn.execute("ALTER TABLE pending_collections ADD COLUMN rate_chart TEXT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def append(self, cust_code, collection_date, session, animal_type, qty, fat, rate, rate_chart=None):
+        check_reading(qty, fat, rate)
+        with self._lock, metrics.timer("journal.append"):
+            clash = self._conn.execute("""SELECT 1 FROM pending_collections WHERE customer_code=? AND
+                collection_date=? AND session=? AND status = 'pending'""",
+                                       (cust_code, collection_date.isoformat(), session)).fetchone()
+            if clash:
+                raise Exception(f"{session} entry already exists for this customer on {collection_date}")
+            cur = self._conn.execute("""INSERT INTO pending_collections (customer_code, collection_date, session,
+                animal_type, quantity_liters, fat, rate, rate_chart) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                     (cust_code, collection_date.isoformat(), session, animal_type, qty, fat, rate,
+                                      rate_chart))
+            return cur.lastrowid
+
+    def pending(self, limit=SYNC_BATCH):
+        with self._lock:
+            return self._conn.execute("""SELECT id, customer_code, collection_date, session, animal_type,
+                quantity_liters, fat, rate, rate_chart FROM pending_collections WHERE status = 'pending'
+                ORDER BY id LIMIT ?""", (limit,)).fetchall()
+
+    def mark(self, outcomes):
+        # outcomes: (journal id, status, server id, error) tuples, written in one transaction.
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("""UPDATE pending_collections SET status=?, server_id=?, error=?,
+                synced_at=CURRENT_TIMESTAMP WHERE id=?""", [(s, sid, err, jid) for jid, s, sid, err in outcomes])
+            self._conn.execute("COMMIT")
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM pending_collections GROUP BY status"))
+
+    def purge_synced(self, older_than_days=PURGE_SYNCED_DAYS):
+        with self._lock:
+            self._conn.execute("""DELETE FROM pending_collections WHERE status = 'synced'
+                AND synced_at < datetime('now', ?)""", (f"-{int(older_than_days)} days",))
+
+
+def check_reading(qty, fat, rate=None):
+    # A value the server cannot store would otherwise only fail at sync time.
+    # rate is None for imported rows still to be priced from the chart.
+    if not all(math.isfinite(v) for v in (qty, fat, rate) if v is not None):
+        raise ValueError("quantity, fat and rate must be numbers")
+    if not 0 < qty <= MAX_QUANTITY:
+        raise ValueError(f"quantity must be between 0 and {MAX_QUANTITY:g} L, got {qty:g}")
+    if not 0 <= fat <= MAX_FAT:
+        raise ValueError(f"fat must be between 0 and {MAX_FAT:g}%, got {fat:g}")
+    if rate is not None and not 0 <= rate <= MAX_RATE:
+        raise ValueError(f"rate must be between 0 and {MAX_RATE:g}, got {rate:g}")
+
+
+def flush(journal, batch_size=SYNC_BATCH):
+    # Pushes one batch to PostgreSQL; returns the outcomes written back to the journal.
+    batch = journal.pending(batch_size)
+    if not batch:
+        return []
+    records = [(r[1], date.fromisoformat(r[2]), r[3], r[4], r[5], r[6], r[7], r[8]) for r in batch]
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SAVEPOINT journal_batch")
+        try:
+            inserted, known = db.insert_collections(cur, records)
+            failed = {}
+        except (psycopg2.DataError, psycopg2.IntegrityError):
+            # One bad reading must not hold back the batch (and every reading after it).
+            cur.execute("ROLLBACK TO SAVEPOINT journal_batch")
+            inserted, known, failed = db.insert_collections_each(cur, records)
+        conflicts = [rec for i, rec in enumerate(records)
+                     if i not in failed and rec[0] in known and rec[:3] not in inserted]
+        existing = {}
+        if conflicts:
+            # A row already on the server may be this very reading, written by a flush
+            # whose journal update was lost (crash or power cut after the commit).
+            cur.execute("""SELECT id, customer_code, collection_date, session, quantity_liters, fat, rate
+                FROM milk_collection WHERE (customer_code, collection_date, session) IN
+                (SELECT * FROM unnest(%s::int[], %s::date[], %s::text[]))""",
+                        ([c[0] for c in conflicts], [c[1] for c in conflicts], [c[2] for c in conflicts]))
+            existing = {(r[1], r[2], r[3]): r for r in cur.fetchall()}
+    outcomes = []
+    for i, (row, rec) in enumerate(zip(batch, records)):
+        key = rec[:3]
+        if i in failed:
+            outcomes.append((row[0], "rejected", None, failed[i]))
+        elif rec[0] not in known:
+            outcomes.append((row[0], "rejected", None, f"unknown customer code {rec[0]}"))
+        elif key in inserted:
+            outcomes.append((row[0], "synced", inserted.pop(key), None))
+        elif key in existing and [float(v) for v in existing[key][4:7]] == [round(v, 2) for v in rec[4:7]]:
+            outcomes.append((row[0], "synced", existing[key][0], None))
+        else:
+            outcomes.append((row[0], "duplicate", None,
+                             f"{rec[2]} entry already exists for customer {rec[0]} on {rec[1]}"))
+    journal.mark(outcomes)
+    return outcomes
+
+
+class Syncer:
+    def __init__(self, journal, interval=SYNC_INTERVAL, batch_size=SYNC_BATCH):
+        self.journal = journal
+        self.interval = interval
+        self.batch_size = batch_size
+        self.online = True
+        self.last_error = None
+        self._listeners = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, fn):
+        # fn(outcomes) is called from the sync thread after each flushed batch.
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def start(self):
+        if self._thread is None:
+            # Synced rows are only kept a while, as a record of what went to the server.
+            self.journal.purge_synced()
+            self._thread = threading.Thread(target=self._run, name="dairy-syncer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        backoff = self.interval
+        while not self._stop.is_set():
+            try:
+                with metrics.timer("journal.flush"):
+                    outcomes = flush(self.journal, self.batch_size)
+                self.online, self.last_error, backoff = True, None, self.interval
+            except Exception as ex:
+                outcomes = []
+                self.online, self.last_error = False, str(ex).strip()
+                backoff = min(backoff * 2, 60)
+            for fn in list(self._listeners):
+                fn(outcomes)
+            if outcomes and len(outcomes) == self.batch_size:
+                continue
+            self._wake.wait(backoff)
+            self._wake.clear()
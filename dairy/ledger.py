@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import date
+from decimal import Decimal
+from itertools import groupby
+
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+from . import billing, db, metrics
+
+# Bills of closed cycles (the period has ended) are stored once and served from
+# here afterwards. Any insert, update or delete of a reading inside a stored
+# cycle marks its snapshot invalidated, and the next view builds a fresh one;
+# invalidated snapshots are kept for reference.
+LEDGER_DDL = """
+CREATE TABLE IF NOT EXISTS bill_snapshots (
+    id SERIAL PRIMARY KEY, customer_code INT NOT NULL, start_date DATE NOT NULL, end_date DATE NOT NULL,
+    lines JSONB NOT NULL, readings INT NOT NULL, liters NUMERIC NOT NULL, total NUMERIC NOT NULL, charts TEXT,
+    pdf_path TEXT, pdf_sha256 TEXT, created_at TIMESTAMP NOT NULL DEFAULT now(), invalidated_at TIMESTAMP);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_bill_snapshots_current
+    ON bill_snapshots (customer_code, start_date, end_date) WHERE invalidated_at IS NULL;
+
+CREATE OR REPLACE FUNCTION invalidate_bill_snapshots() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE bill_snapshots SET invalidated_at = now() WHERE invalidated_at IS NULL
+            AND customer_code = OLD.customer_code AND OLD.collection_date BETWEEN start_date AND end_date;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE bill_snapshots SET invalidated_at = now() WHERE invalidated_at IS NULL
+            AND customer_code = NEW.customer_code AND NEW.collection_date BETWEEN start_date AND end_date;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS milk_collection_bill_snapshots ON milk_collection;
+CREATE TRIGGER milk_collection_bill_snapshots AFTER INSERT OR UPDATE OR DELETE ON milk_collection
+    FOR EACH ROW EXECUTE FUNCTION invalidate_bill_snapshots();
+"""
+
+
+def install(cur):
+    columns = db.float_columns(cur, "bill_snapshots")
+    if columns:
+        cur.execute("ALTER TABLE bill_snapshots " + ", ".join(f"ALTER COLUMN {c} TYPE NUMERIC" for c in columns))
+    cur.execute(LEDGER_DDL)
+
+
+def is_closed(end_date):
+    return end_date < date.today()
+
+
+# NUMERIC columns come back as Decimal; JSON keeps them as strings.
+_NUMERIC_FIELDS = ("quantity_liters", "fat", "rate", "amount")
+
+
+def _dumps(value):
+    return json.dumps(value, default=str)
+
+
+def _chart_labels(rows):
+    # The chart versions recorded on the readings when they were priced.
+    return "; ".join(sorted({r["rate_chart"] for r in rows if r["rate_chart"]})) or None
+
+
+def _decode(snapshot):
+    for line in snapshot["lines"]:
+        line["collection_date"] = date.fromisoformat(line["collection_date"])
+        for key in _NUMERIC_FIELDS:
+            if line[key] is not None:
+                line[key] = Decimal(str(line[key]))
+    return snapshot
+
+
+def fetch_snapshot(cust_code, start_date, end_date):
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT * FROM bill_snapshots WHERE customer_code=%s AND start_date=%s AND end_date=%s
+            AND invalidated_at IS NULL""", (cust_code, start_date, end_date))
+        snapshot = cur.fetchone()
+    return _decode(snapshot) if snapshot is not None else None
+
+
+def _take_snapshot(cust_code, start_date, end_date):
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # FOR SHARE holds off concurrent edits of these rows until the snapshot
+        # is committed, so their trigger is guaranteed to see (and invalidate) it.
+        cur.execute("""SELECT collection_date, session, animal_type, quantity_liters, fat, rate, amount, rate_chart
+            FROM milk_collection WHERE customer_code=%s AND collection_date BETWEEN %s AND %s
+            ORDER BY collection_date FOR SHARE""", (cust_code, start_date, end_date))
+        rows = [dict(r) for r in cur.fetchall()]
+        total = sum(r["amount"] for r in rows)
+        if not rows:
+            # Nothing to bill: ad-hoc ranges without readings are not stored.
+            return rows, total
+        cur.execute("""INSERT INTO bill_snapshots (customer_code, start_date, end_date, lines, readings, liters,
+                total, charts) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (customer_code, start_date, end_date) WHERE invalidated_at IS NULL DO NOTHING""",
+                    (cust_code, start_date, end_date, Json(rows, dumps=_dumps), len(rows),
+                     sum(r["quantity_liters"] or 0 for r in rows), total, _chart_labels(rows)))
+    return rows, total
+
+
+def fetch_period_snapshots(start_date, end_date):
+    # Current snapshots of every customer billed in a closed cycle, with the
+    # customer's name; customers without one are snapshotted first, together.
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT customer_code, collection_date, session, animal_type, quantity_liters, fat, rate,
+                amount, rate_chart
+            FROM milk_collection m WHERE collection_date BETWEEN %s AND %s AND NOT EXISTS (
+                SELECT 1 FROM bill_snapshots s WHERE s.customer_code = m.customer_code AND s.start_date = %s
+                AND s.end_date = %s AND s.invalidated_at IS NULL)
+            ORDER BY customer_code, collection_date FOR SHARE""", (start_date, end_date, start_date, end_date))
+        missing = []
+        for code, group in groupby(cur.fetchall(), key=lambda r: r["customer_code"]):
+            rows = [{k: v for k, v in r.items() if k != "customer_code"} for r in group]
+            missing.append((code, start_date, end_date, Json(rows, dumps=_dumps), len(rows),
+                            sum(r["quantity_liters"] or 0 for r in rows), sum(r["amount"] for r in rows),
+                            _chart_labels(rows)))
+        if missing:
+            execute_values(cur, """INSERT INTO bill_snapshots (customer_code, start_date, end_date, lines, readings,
+                liters, total, charts) VALUES %s
+                ON CONFLICT (customer_code, start_date, end_date) WHERE invalidated_at IS NULL DO NOTHING""",
+                           missing, page_size=500)
+        cur.execute("""SELECT s.*, c.name AS customer_name FROM bill_snapshots s
+            JOIN customers c ON c.code = s.customer_code
+            WHERE s.start_date = %s AND s.end_date = %s AND s.invalidated_at IS NULL ORDER BY s.customer_code""",
+                    (start_date, end_date))
+        return [_decode(s) for s in cur.fetchall()]
+
+
+@metrics.timed("ledger.get_bill")
+def get_bill(cust_code, start_date, end_date):
+    # Same result as db.fetch_bill; closed cycles come from (or go into) the ledger.
+    if not is_closed(end_date):
+        return db.fetch_bill(cust_code, start_date, end_date)
+    snapshot = fetch_snapshot(cust_code, start_date, end_date)
+    if snapshot is not None:
+        return snapshot["lines"], snapshot["total"]
+    return _take_snapshot(cust_code, start_date, end_date)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stored_pdf(snapshot):
+    # The PDF recorded with a snapshot, if it is still there unchanged.
+    path = snapshot["pdf_path"]
+    if path and os.path.exists(path) and _sha256(path) == snapshot["pdf_sha256"]:
+        return path
+    return None
+
+
+def print_bill(cust_code, customer_name, start_date, end_date, filename, rows=None, total=None):
+    # Reprints of a closed cycle reuse the PDF recorded with its snapshot as
+    # long as the file is still there unchanged; rows/total may pass an open
+    # cycle's bill that is already on screen. Returns the PDF path.
+    if not is_closed(end_date):
+        if rows is None:
+            rows, total = db.fetch_bill(cust_code, start_date, end_date)
+        return billing.render_bill_pdf(filename, customer_name, start_date, end_date, rows, total)
+    snapshot = fetch_snapshot(cust_code, start_date, end_date)
+    if snapshot is None:
+        _take_snapshot(cust_code, start_date, end_date)
+        snapshot = fetch_snapshot(cust_code, start_date, end_date)
+    if snapshot is None:
+        # No readings in the range, or invalidated again straight away by a concurrent edit.
+        rows, total = db.fetch_bill(cust_code, start_date, end_date)
+        return billing.render_bill_pdf(filename, customer_name, start_date, end_date, rows, total)
+    path = _stored_pdf(snapshot)
+    if path:
+        return path
+    billing.render_bill_pdf(filename, customer_name, start_date, end_date, snapshot["lines"], snapshot["total"])
+    path = os.path.abspath(filename)
+    with db.get_conn() as conn:
+        conn.cursor().execute("UPDATE bill_snapshots SET pdf_path=%s, pdf_sha256=%s WHERE id=%s",
+                              (path, _sha256(path), snapshot["id"]))
+    return path
+
+
+@metrics.timed("ledger.run_bill_batch")
+def run_bill_batch(start_date, end_date, out_dir=".", combined=False, workers=None, progress=None):
+    # billing.run_bill_batch for every customer, with closed cycles served from
+    # the ledger: bills come from their snapshots, and a PDF already recorded
+    # with one is copied into out_dir instead of being rendered again.
+    if not is_closed(end_date):
+        return billing.run_bill_batch(start_date, end_date, out_dir, combined, workers, progress)
+    snapshots = fetch_period_snapshots(start_date, end_date)
+    bills = [{"customer_code": s["customer_code"], "customer_name": s["customer_name"], "rows": s["lines"],
+              "total": s["total"]} for s in snapshots]
+    if combined:
+        return billing.render_bills(bills, start_date, end_date, out_dir, True, workers, progress)
+    os.makedirs(out_dir, exist_ok=True)
+    written, todo = [], []
+    for snapshot, bill in zip(snapshots, bills):
+        filename = os.path.abspath(os.path.join(out_dir, billing.bill_filename(
+            bill["customer_name"], start_date, end_date, bill["customer_code"])))
+        stored = _stored_pdf(snapshot)
+        if stored is None:
+            todo.append((snapshot, bill, filename))
+            continue
+        if stored != filename:
+            shutil.copyfile(stored, filename)
+        written.append(filename)
+        if progress:
+            progress(len(written), len(bills), filename)
+    if todo:
+        reused = len(written)
+
+        def rendered_progress(done, total, filename):
+            if progress:
+                progress(reused + done, len(bills), filename)
+        rendered = billing.render_bills([b for _, b, _ in todo], start_date, end_date, out_dir, False, workers,
+                                        rendered_progress)
+        written.extend(os.path.abspath(path) for path in rendered)
+        with db.get_conn() as conn:
+            conn.cursor().executemany("UPDATE bill_snapshots SET pdf_path=%s, pdf_sha256=%s WHERE id=%s",
+                                      [(filename, _sha256(filename), snapshot["id"]) for snapshot, _, filename in todo])
+    return sorted(written)
@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from psycopg2.extensions import connection as _pg_connection, cursor as _pg_cursor
+
+SLOW_QUERY_MS = float(os.environ.get("DAIRY_SLOW_QUERY_MS", "200"))
+SAMPLE_SIZE = 2048
+
+slow_log = logging.getLogger("dairy.slow")
+_stats = {}
+_lock = threading.Lock()
+
+
+class Stat:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def as_dict(self):
+        ordered = sorted(self.samples)
+        p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] if ordered else 0.0
+        return {"name": self.name, "count": self.count, "errors": self.errors, "total_ms": self.total * 1000,
+                "mean_ms": self.total * 1000 / self.count if self.count else 0.0, "p95_ms": p95 * 1000,
+                "max_ms": self.max * 1000, "rows": self.rows}
+
+
+def record(name, seconds, rows=None, error=False):
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = Stat(name)
+        stat.count += 1
+        stat.total += seconds
+        stat.max = max(stat.max, seconds)
+        stat.samples.append(seconds)
+        if rows:
+            stat.rows += rows
+        if error:
+            stat.errors += 1
+
+
+def count_rows(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return None
+
+
+@contextmanager
+def timer(name):
+    # The yielded dict may be given a "rows" count by the caller.
+    info = {}
+    start = time.perf_counter()
+    try:
+        yield info
+    except BaseException:
+        record(name, time.perf_counter() - start, error=True)
+        raise
+    record(name, time.perf_counter() - start, info.get("rows"))
+
+
+def timed(name):
+    def wrap(fn):
+        def timed_fn(*args, **kwargs):
+            with timer(name) as info:
+                result = fn(*args, **kwargs)
+                info["rows"] = count_rows(result)
+            return result
+        timed_fn.__name__ = fn.__name__
+        timed_fn.__wrapped__ = fn
+        return timed_fn
+    return wrap
+
+
+def snapshot():
+    with _lock:
+        return sorted((s.as_dict() for s in _stats.values()), key=lambda s: s["total_ms"], reverse=True)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def enable_slow_log(path, threshold_ms=None):
+    global SLOW_QUERY_MS
+    if threshold_ms is not None:
+        SLOW_QUERY_MS = threshold_ms
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_log.addHandler(handler)
+    slow_log.setLevel(logging.INFO)
+    slow_log.propagate = False
+    return handler
+
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def statement_name(sql):
+    # execute_values inlines its rows, so literals are masked to keep one
+    # entry per statement shape.
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = _LITERALS.sub("?", _WHITESPACE.sub(" ", str(sql[:400])).strip())
+    return "sql: " + (sql[:70] + "..." if len(sql) > 70 else sql)
+
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        error = False
+        try:
+            return super().execute(query, vars)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self._record(query, vars, time.perf_counter() - start, error)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        error = False
+        try:
+            return super().copy_expert(sql, file, size)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self._record(sql, None, time.perf_counter() - start, error)
+
+    def _record(self, query, vars, seconds, error):
+        rows = self.rowcount if not error and self.rowcount and self.rowcount > 0 else None
+        record(statement_name(query), seconds, rows, error)
+        if seconds * 1000 >= SLOW_QUERY_MS and slow_log.handlers:
+            slow_log.info("%.1f ms rows=%s %s", seconds * 1000, rows,
+                          _WHITESPACE.sub(" ", self.query.decode("utf-8", "replace") if self.query
+                                          else str(query))[:2000])
+
+
+_timed_cursor_classes = {}
+
+
+class InstrumentedConnection(_pg_connection):
+    # Wraps whatever cursor class is requested (plain, RealDictCursor, named
+    # server-side cursors) so every statement is timed without touching callers.
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or _pg_cursor
+        timed_cls = _timed_cursor_classes.get(factory)
+        if timed_cls is None:
+            timed_cls = _timed_cursor_classes[factory] = type(f"Timed{factory.__name__}",
+                                                              (_TimedCursorMixin, factory), {})
+        kwargs["cursor_factory"] = timed_cls
+        return super().cursor(*args, **kwargs)
+
+
+if os.environ.get("DAIRY_SLOW_QUERY_LOG"):
+    enable_slow_log(os.environ["DAIRY_SLOW_QUERY_LOG"])
@@ -0,0 +1,212 @@
+import gzip
+import os
+import re
+from datetime import date
+
+from . import db
+
+# milk_collection is range-partitioned on collection_date, one partition per
+# month (or per year with DAIRY_PARTITION_BY=year; pick one before the first
+# partitions are created, the two layouts cannot be mixed). Rows outside every
+# partition land in milk_collection_default until their period is created.
+PARTITION_BY = os.environ.get("DAIRY_PARTITION_BY", "month")
+PARTITION_AHEAD = 3
+DEFAULT_PARTITION = "milk_collection_default"
+ARCHIVE_DIR = "archive"
+_NAME = re.compile(r"^milk_collection_y(\d{4})(?:m(\d{2}))?$")
+
+# The primary key and unique constraint must contain the partition key, hence
+# (id, collection_date); ids still come from the one sequence and stay unique.
+COLLECTION_DDL = """
+CREATE SEQUENCE IF NOT EXISTS milk_collection_id_seq;
+CREATE TABLE milk_collection (
+    id INT NOT NULL DEFAULT nextval('milk_collection_id_seq'), customer_code INT REFERENCES customers(code),
+    collection_date DATE NOT NULL, session TEXT NOT NULL, animal_type TEXT, quantity_liters NUMERIC(10,2),
+    fat NUMERIC(5,2), rate NUMERIC(10,2), snf NUMERIC(5,2), rate_chart TEXT,
+    amount NUMERIC(12,2) GENERATED ALWAYS AS (round(quantity_liters * rate, 2)) STORED,
+    PRIMARY KEY (id, collection_date),
+    CONSTRAINT unique_collection UNIQUE (customer_code, collection_date, session))
+    PARTITION BY RANGE (collection_date);
+ALTER SEQUENCE milk_collection_id_seq OWNED BY milk_collection.id;
+CREATE TABLE milk_collection_default PARTITION OF milk_collection DEFAULT;
+"""
+
+
+def _next_month(d):
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def bounds(name):
+    # [start, end) of a partition from its name, or None for other tables.
+    m = _NAME.match(name)
+    if m is None:
+        return None
+    year = int(m.group(1))
+    if m.group(2):
+        start = date(year, int(m.group(2)), 1)
+        return start, _next_month(start)
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def partition_for(d):
+    if PARTITION_BY == "year":
+        return f"milk_collection_y{d.year}"
+    return f"milk_collection_y{d.year}m{d.month:02d}"
+
+
+def is_partitioned(cur):
+    # None when milk_collection does not exist yet.
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('milk_collection')")
+    row = cur.fetchone()
+    return None if row is None else row[0] == "p"
+
+
+def list_partitions(cur):
+    cur.execute("""SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'milk_collection'::regclass ORDER BY c.relname""")
+    return [r[0] for r in cur.fetchall()]
+
+
+def insert_columns(cur, table="milk_collection"):
+    cur.execute("""SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema()
+        AND table_name = %s AND is_generated = 'NEVER' ORDER BY ordinal_position""", (table,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def install(cur):
+    # Creates milk_collection partitioned, or migrates an unpartitioned one.
+    state = is_partitioned(cur)
+    if state is None:
+        cur.execute(COLLECTION_DDL)
+    elif not state:
+        migrate(cur)
+    ensure_partitions(cur)
+
+
+def migrate(cur):
+    # Copies the old heap table into the partitioned layout in one transaction.
+    # Its triggers go with it; init_db installs them on the new table afterwards,
+    # and the summary tables are already correct since no row changes.
+    cur.execute("LOCK TABLE milk_collection IN ACCESS EXCLUSIVE MODE")
+    cur.execute("""ALTER TABLE milk_collection RENAME TO milk_collection_unpartitioned;
+        ALTER TABLE milk_collection_unpartitioned RENAME CONSTRAINT milk_collection_pkey
+            TO milk_collection_unpartitioned_pkey;
+        ALTER TABLE milk_collection_unpartitioned RENAME CONSTRAINT unique_collection
+            TO unique_collection_unpartitioned;""")
+    cur.execute(COLLECTION_DDL)
+    cur.execute("SELECT DISTINCT date_trunc('month', collection_date)::DATE FROM milk_collection_unpartitioned")
+    ensure_partitions_for(cur, [d for (d,) in cur.fetchall()])
+    old = set(insert_columns(cur, "milk_collection_unpartitioned"))
+    columns = ", ".join(c for c in insert_columns(cur) if c in old)
+    cur.execute(f"INSERT INTO milk_collection ({columns}) SELECT {columns} FROM milk_collection_unpartitioned")
+    cur.execute("DROP TABLE milk_collection_unpartitioned CASCADE")
+    cur.execute("ANALYZE milk_collection")
+
+
+def ensure_partitions(cur, start=None, end=None):
+    # Creates the partitions covering start..end (default: the current period
+    # and PARTITION_AHEAD months after it) plus any period that has rows sitting
+    # in the default partition. Returns the names created.
+    today = date.today()
+    start = start or today
+    if end is None:
+        end = today
+        for _ in range(PARTITION_AHEAD):
+            end = _next_month(end.replace(day=1))
+    wanted = set()
+    d = start.replace(day=1)
+    while d <= end:
+        wanted.add(partition_for(d))
+        d = _next_month(d)
+    return _ensure(cur, wanted)
+
+
+def ensure_partitions_for(cur, dates):
+    # Like ensure_partitions, but only for the periods the given dates fall in:
+    # one mistyped year must not create every month up to it.
+    return _ensure(cur, {partition_for(d) for d in dates})
+
+
+def _ensure(cur, wanted):
+    wanted = set(wanted)
+    cur.execute(f"SELECT DISTINCT date_trunc('month', collection_date)::DATE FROM {DEFAULT_PARTITION}")
+    wanted.update(partition_for(d) for (d,) in cur.fetchall())
+    created = []
+    for name in sorted(wanted - set(list_partitions(cur))):
+        lo, hi = bounds(name)
+        _create_partition(cur, name, lo, hi)
+        created.append(name)
+    return created
+
+
+def _create_partition(cur, name, lo, hi):
+    # A new partition cannot be created while the default partition holds rows
+    # of its range, so those are moved through a temporary table. The delete and
+    # re-insert fire the summary triggers in pairs and cancel out.
+    cur.execute(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE collection_date >= %s "
+                f"AND collection_date < %s)", (lo, hi))
+    stray = cur.fetchone()[0]
+    columns = ", ".join(insert_columns(cur))
+    if stray:
+        cur.execute(f"""CREATE TEMP TABLE stray_collections ON COMMIT DROP AS SELECT {columns}
+            FROM {DEFAULT_PARTITION} WHERE collection_date >= %s AND collection_date < %s""", (lo, hi))
+        cur.execute(f"DELETE FROM {DEFAULT_PARTITION} WHERE collection_date >= %s AND collection_date < %s",
+                    (lo, hi))
+    cur.execute(f"CREATE TABLE {name} PARTITION OF milk_collection FOR VALUES FROM (%s) TO (%s)",
+                (str(lo), str(hi)))
+    if stray:
+        cur.execute(f"INSERT INTO milk_collection ({columns}) SELECT {columns} FROM stray_collections")
+        cur.execute("DROP TABLE stray_collections")
+
+
+def create_partitions(start=None, end=None):
+    with db.get_conn() as conn:
+        return ensure_partitions(conn.cursor(), start, end)
+
+
+def archive_partitions(before, out_dir=ARCHIVE_DIR):
+    # Detaches every partition that ends on or before `before`, writes it to
+    # out_dir/<partition>.csv.gz and drops it. Detaching fires no triggers, so
+    # the summary tables keep the archived periods (rebuild-summaries would
+    # forget them). Returns [(partition, rows, path)].
+    if before > date.today().replace(day=1):
+        raise ValueError("only closed periods can be archived; the current month is still open")
+    os.makedirs(out_dir, exist_ok=True)
+    archived = []
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        for name in list_partitions(cur):
+            period = bounds(name)
+            if period is None or period[1] > before:
+                continue
+            path = os.path.join(out_dir, f"{name}.csv.gz")
+            columns = ", ".join(insert_columns(cur, name))
+            cur.execute(f"ALTER TABLE milk_collection DETACH PARTITION {name}")
+            with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+                cur.copy_expert(f"COPY {name} ({columns}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+            rows = cur.rowcount
+            cur.execute(f"DROP TABLE {name}")
+            # Each partition is committed on its own so a failure keeps earlier archives consistent.
+            conn.commit()
+            archived.append((name, rows, path))
+    return archived
+
+
+def restore_partition(path):
+    # Loads an archive written by archive_partitions back as a partition. The
+    # table is filled while detached and then attached, so the summary tables
+    # (which still count these rows) are not incremented a second time.
+    name = os.path.basename(path).split(".")[0]
+    period = bounds(name)
+    if period is None:
+        raise ValueError(f"{path}: not a milk_collection partition archive")
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(f"CREATE TABLE {name} (LIKE milk_collection INCLUDING DEFAULTS INCLUDING GENERATED)")
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+            header = f.readline().strip()
+            cur.copy_expert(f"COPY {name} ({header}) FROM STDIN WITH (FORMAT csv)", f)
+            rows = cur.rowcount
+        cur.execute(f"ALTER TABLE milk_collection ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                    (str(period[0]), str(period[1])))
+        return name, rows
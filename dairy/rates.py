@@ -0,0 +1,431 @@
+import csv
+import hashlib
+import io
+import math
+import os
+import threading
+from array import array
+from datetime import date
+
+# The chart engine needs no database: psycopg2 and db are imported by the
+# functions that read or write charts, so lookups can be used (and tested) alone.
+
+# Absolute, so the chart is found (and watched) whatever the working directory.
+FAT_RATE_FILE = os.path.abspath(os.environ.get(
+    "DAIRY_FAT_RATE_FILE", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fat_rate.csv")))
+RELOAD_INTERVAL = float(os.environ.get("DAIRY_RATE_RELOAD_SECS", "2"))
+# Recorded in milk_collection.rate_chart for rates typed in or taken from an import file.
+MANUAL_RATE = "manual"
+NAN = float("nan")
+
+# Replaced as a whole when fat_rate.csv changes or a chart is published; readers take one reference
+# and use it throughout, so a lookup never sees half of an old and new chart.
+rate_book = None
+_signature = None
+_published = None
+_reload_lock = threading.Lock()
+
+
+class RateError(ValueError):
+    pass
+
+
+def _axis(values):
+    # Charts are published on a regular grid (e.g. fat 3.0..8.0 in 0.1 steps);
+    # the step is the smallest gap between distinct points.
+    points = sorted(set(round(v, 3) for v in values))
+    if len(points) == 1:
+        return points[0], 1.0, 1
+    step = round(min(b - a for a, b in zip(points, points[1:])), 6)
+    return points[0], step, int(round((points[-1] - points[0]) / step)) + 1
+
+
+class RateChart:
+    def __init__(self, rates, fat_min, fat_step, fat_count, snf_min=None, snf_step=None, snf_count=1,
+                 animal_type=None, effective_from=None, effective_to=None, interpolate=False,
+                 chart_id=None, name="", checksum=None):
+        self.rates = array('d', rates)
+        if len(self.rates) != fat_count * snf_count:
+            raise RateError(f"chart has {len(self.rates)} rates, expected {fat_count * snf_count}")
+        self.fat_min, self.fat_step, self.fat_count = fat_min, fat_step, fat_count
+        self.snf_min, self.snf_step, self.snf_count = snf_min, snf_step, snf_count
+        self.animal_type = animal_type
+        self.effective_from = effective_from
+        self.effective_to = effective_to
+        self.interpolate = interpolate
+        self.chart_id = chart_id
+        self.name = name
+        self.checksum = checksum
+
+    @classmethod
+    def from_points(cls, points, **kwargs):
+        points = list(points)
+        if not points:
+            raise RateError("rate chart is empty")
+        fat_min, fat_step, fat_count = _axis(p[0] for p in points)
+        has_snf = any(p[1] is not None for p in points)
+        snf_min, snf_step, snf_count = _axis(p[1] for p in points) if has_snf else (None, None, 1)
+        rates = array('d', [NAN]) * (fat_count * snf_count)
+        for fat, snf, rate in points:
+            fi = int(round((fat - fat_min) / fat_step))
+            si = int(round((snf - snf_min) / snf_step)) if has_snf else 0
+            rates[fi * snf_count + si] = rate
+        return cls(rates, fat_min, fat_step, fat_count, snf_min, snf_step, snf_count, **kwargs)
+
+    @property
+    def fat_max(self):
+        return self.fat_min + self.fat_step * (self.fat_count - 1)
+
+    @property
+    def label(self):
+        animal = self.animal_type or "All animals"
+        return self.name or f"{animal} chart {self.chart_id or 'default'}"
+
+    @property
+    def version(self):
+        # What milk_collection.rate_chart records: the published chart id, or
+        # the file's content hash, so a revised fat_rate.csv is told apart.
+        if self.chart_id is not None:
+            return f"chart {self.chart_id}"
+        if self.checksum:
+            return f"{self.name or 'default'}@{self.checksum[:12]}"
+        return self.label
+
+    def applies_to(self, animal_type, on_date):
+        if self.animal_type and animal_type and self.animal_type != animal_type:
+            return False
+        if on_date is not None:
+            if self.effective_from and on_date < self.effective_from:
+                return False
+            if self.effective_to and on_date > self.effective_to:
+                return False
+        return True
+
+    def _position(self, value, lo, step, count):
+        # Interpolated charts cover exactly lo..lo+step*(count-1); nearest-point
+        # charts also take readings up to half a step beyond either end.
+        pos = (value - lo) / step
+        if not self.interpolate:
+            return pos if -0.5 <= pos < count - 0.5 else None
+        if pos < -1e-9 or pos > count - 1 + 1e-9:
+            return None
+        if abs(pos - round(pos)) < 1e-9:
+            # A reading on a grid point (give or take float noise) weighs its neighbours zero.
+            pos = float(round(pos))
+        return min(max(pos, 0.0), count - 1.0)
+
+    def lookup(self, fat, snf=None):
+        fp = self._position(fat, self.fat_min, self.fat_step, self.fat_count)
+        if fp is None:
+            return None
+        if self.snf_count > 1:
+            if snf is None:
+                return None
+            sp = self._position(snf, self.snf_min, self.snf_step, self.snf_count)
+            if sp is None:
+                return None
+        else:
+            sp = 0.0
+        if not self.interpolate:
+            fi = min(int(math.floor(fp + 0.5)), self.fat_count - 1)
+            si = min(int(math.floor(sp + 0.5)), self.snf_count - 1)
+            rate = self.rates[fi * self.snf_count + si]
+            return None if math.isnan(rate) else rate
+        # Bilinear interpolation between the surrounding grid points. Neighbours
+        # with zero weight are skipped, so a grid point next to a hole still prices.
+        f0, s0 = int(fp), int(sp)
+        f1, s1 = min(f0 + 1, self.fat_count - 1), min(s0 + 1, self.snf_count - 1)
+        tf, ts = fp - f0, sp - s0
+        r = self.rates
+        n = self.snf_count
+        rate = 0.0
+        for fi, wf in ((f0, 1 - tf), (f1, tf)):
+            for si, ws in ((s0, 1 - ts), (s1, ts)):
+                if wf * ws:
+                    rate += r[fi * n + si] * wf * ws
+        return None if math.isnan(rate) else round(rate, 2)
+
+    def rate(self, fat, snf=None):
+        rate = self.lookup(fat, snf)
+        if rate is None:
+            if self.snf_count > 1 and snf is None:
+                raise RateError(f"{self.label} needs an SNF reading")
+            raise RateError(f"no rate for fat {fat} in {self.label} "
+                            f"(covers {self.fat_min:.1f}-{self.fat_max:.1f})")
+        return rate
+
+    def price_many(self, fats, snfs=None):
+        lookup = self.lookup
+        if snfs is None:
+            return [lookup(f) for f in fats]
+        return [lookup(f, s) for f, s in zip(fats, snfs)]
+
+
+class RateBook:
+    def __init__(self, charts=(), default=None):
+        self.default = default
+        self._by_animal = {}
+        for chart in charts:
+            self._by_animal.setdefault(chart.animal_type, []).append(chart)
+        # Newest effective chart first, so the first match wins.
+        for charts_for_animal in self._by_animal.values():
+            charts_for_animal.sort(key=lambda c: (c.effective_from or date.min, c.chart_id or 0), reverse=True)
+
+    @property
+    def charts(self):
+        return [c for cs in self._by_animal.values() for c in cs]
+
+    def chart_for(self, animal_type, on_date=None):
+        for key in ((animal_type, None) if animal_type is not None else (None,)):
+            for chart in self._by_animal.get(key, ()):
+                if chart.applies_to(animal_type, on_date):
+                    return chart
+        return self.default
+
+    def price(self, animal_type, on_date, fat, snf=None):
+        chart = self.chart_for(animal_type, on_date)
+        if chart is None:
+            raise RateError(f"no rate chart for {animal_type or 'this animal'} on {on_date}")
+        return chart.rate(fat, snf), chart
+
+    def price_readings(self, readings):
+        # readings: iterable of (animal_type, on_date, fat, snf); priced chart by chart.
+        # Returns the rates and the chart that priced each one.
+        readings = list(readings)
+        rates = [None] * len(readings)
+        charts = [None] * len(readings)
+        groups = {}
+        for i, (animal_type, on_date, fat, snf) in enumerate(readings):
+            chart = charts[i] = self.chart_for(animal_type, on_date)
+            if chart is not None:
+                groups.setdefault(id(chart), (chart, []))[1].append(i)
+        for chart, indexes in groups.values():
+            priced = chart.price_many([readings[i][2] for i in indexes],
+                                      [readings[i][3] for i in indexes] if chart.snf_count > 1 else None)
+            for i, rate in zip(indexes, priced):
+                rates[i] = rate
+        return rates, charts
+
+
+def load_chart_csv(path, **kwargs):
+    # Read once and hashed as read, so the checksum is that of the rates parsed.
+    with open(path, 'rb') as file:
+        data = file.read()
+    kwargs.setdefault("checksum", hashlib.sha256(data).hexdigest())
+    points = []
+    for row in csv.DictReader(io.StringIO(data.decode('utf-8-sig'), newline='')):
+        snf = row.get('SNF')
+        points.append((float(row['Fat']), float(snf) if snf not in (None, '') else None, float(row['Rate'])))
+    return RateChart.from_points(points, **kwargs)
+
+
+def fetch_published_charts():
+    from psycopg2.extras import RealDictCursor
+    from . import db
+
+    with db.get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT id, name, animal_type, effective_from, effective_to, fat_min, fat_step, fat_count,
+            snf_min, snf_step, snf_count, interpolate, rates FROM rate_charts ORDER BY id;""")
+        rows = cur.fetchall()
+    return [RateChart(r["rates"], r["fat_min"], r["fat_step"], r["fat_count"], r["snf_min"], r["snf_step"],
+                      r["snf_count"], animal_type=r["animal_type"], effective_from=r["effective_from"],
+                      effective_to=r["effective_to"], interpolate=r["interpolate"], chart_id=r["id"],
+                      name=r["name"] or "")
+            for r in rows]
+
+
+def _published_signature():
+    # Cheap enough to poll: a chart published (or deleted) since changes it.
+    from . import db
+
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*), MAX(id) FROM rate_charts")
+        return tuple(cur.fetchone())
+
+
+def publish_chart(chart):
+    from . import db
+
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""INSERT INTO rate_charts (name, animal_type, effective_from, effective_to, fat_min, fat_step,
+            fat_count, snf_min, snf_step, snf_count, interpolate, rates)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+                    (chart.name or None, chart.animal_type, chart.effective_from, chart.effective_to,
+                     chart.fat_min, chart.fat_step, chart.fat_count, chart.snf_min, chart.snf_step,
+                     chart.snf_count, chart.interpolate, list(chart.rates)))
+        chart.chart_id = cur.fetchone()[0]
+    return chart.chart_id
+
+
+def load_rate_book(path=FAT_RATE_FILE, include_published=True):
+    charts = fetch_published_charts() if include_published else []
+    default = load_chart_csv(path, name=os.path.basename(path))
+    return RateBook(charts, default)
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def ensure_loaded(path=FAT_RATE_FILE):
+    # With the server unreachable only fat_rate.csv is loaded; the watcher
+    # adds the published charts once it is back.
+    import psycopg2
+
+    global rate_book, _signature, _published
+    if rate_book is None:
+        # Taken before reading: a write landing in between shows up as a change next time.
+        _signature = _file_signature(path)
+        try:
+            published = _published_signature()
+            charts = fetch_published_charts()
+        except psycopg2.OperationalError:
+            published, charts = None, []
+        _published = published
+        try:
+            rate_book = RateBook(charts, load_chart_csv(path, name=os.path.basename(path)))
+        except FileNotFoundError:
+            # Published charts still apply; only the flat default chart is missing.
+            rate_book = RateBook(charts)
+            raise
+    return rate_book
+
+
+def reload_if_changed(path=FAT_RATE_FILE):
+    # Swaps in a new rate book when fat_rate.csv changed (mtime/size, then
+    # content hash) or a chart was published; returns it, else None. A file
+    # that fails to parse (e.g. saved half-way) raises and is retried once it
+    # changes again. While the database is unreachable a revised file is
+    # applied with the published charts already loaded, and the charts are
+    # re-read once it is back.
+    import psycopg2
+
+    global rate_book, _signature, _published
+    with _reload_lock:
+        book = rate_book
+        signature = _file_signature(path)
+        try:
+            published = _published_signature()
+        except psycopg2.Error:
+            published = _published
+        if signature == _signature and published == _published:
+            return None
+        default = book.default if book is not None else None
+        if signature != _signature and signature is not None:
+            try:
+                chart = load_chart_csv(path, name=os.path.basename(path))
+            except Exception:
+                _signature = signature
+                raise
+            if default is None or chart.checksum != default.checksum:
+                default = chart
+        charts = book.charts if book is not None else []
+        if published != _published:
+            try:
+                charts = fetch_published_charts()
+            except psycopg2.Error:
+                published = _published
+        changed = (book is None or default is not book.default or published != _published)
+        # Recorded only once the new book is in place, so a failed reload is retried next time.
+        if changed:
+            rate_book = RateBook(charts, default)
+        _signature, _published = signature, published
+        return rate_book if changed else None
+
+
+def suggest(fat, animal_type=None, on_date=None, snf=None):
+    # (rate, chart version) for the collection form, or (None, None).
+    book = rate_book
+    chart = book.chart_for(animal_type, on_date) if book is not None else None
+    try:
+        rate = chart.lookup(float(fat), snf) if chart else None
+    except ValueError:
+        rate = None
+    return (rate, chart.version) if rate is not None else (None, None)
+
+
+def quote(animal_type, on_date, fat, snf=None):
+    # (rate, chart version); raises RateError when no chart prices the reading.
+    book = rate_book
+    if book is None:
+        raise RateError("rate charts are not loaded")
+    rate, chart = book.price(animal_type, on_date, fat, snf)
+    return rate, chart.version
+
+
+class RateWatcher:
+    # Polls fat_rate.csv and rate_charts on its own thread and hot-swaps the
+    # rate book when either changes. Listeners get fn(book, error): the new
+    # book, or None and the reason a changed file could not be loaded (each
+    # error once, not on every poll).
+    def __init__(self, path=FAT_RATE_FILE, interval=RELOAD_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="dairy-rates", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            try:
+                book, error = reload_if_changed(self.path), None
+            except Exception as ex:
+                book, error = None, f"{os.path.basename(self.path)} not reloaded: {ex}"
+            if error == reported and book is None:
+                continue
+            reported = error
+            if book is not None or error:
+                for fn in list(self._listeners):
+                    fn(book, error)
+
+
+def reprice_period(start_date, end_date, animal_type=None, book=None, include_manual=False):
+    # Rates typed in or taken from an import file (rate_chart = MANUAL_RATE)
+    # are kept unless include_manual is set, and so are rows saved before
+    # rate_chart was recorded (NULL): many of those were typed in by hand.
+    from psycopg2.extras import execute_values
+    from . import db
+
+    book = book or ensure_loaded()
+    with db.get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""SELECT id, animal_type, collection_date, fat, snf, rate, rate_chart FROM milk_collection
+            WHERE collection_date BETWEEN %s AND %s AND (%s IS NULL OR animal_type = %s)
+            AND (%s OR rate_chart <> %s)""",
+                    (start_date, end_date, animal_type, animal_type, include_manual, MANUAL_RATE))
+        rows = cur.fetchall()
+        new_rates, charts = book.price_readings((r[1], r[2], float(r[3]), None if r[4] is None else float(r[4]))
+                                                for r in rows)
+        changes = [(r[0], rate, chart.version) for r, rate, chart in zip(rows, new_rates, charts)
+                   if rate is not None and (r[5] is None or round(rate, 2) != float(r[5]) or r[6] != chart.version)]
+        unpriced = sum(1 for rate in new_rates if rate is None)
+        if changes:
+            execute_values(cur, """UPDATE milk_collection m SET rate = v.rate, rate_chart = v.rate_chart
+                FROM (VALUES %s) AS v(id, rate, rate_chart) WHERE m.id = v.id""", changes, page_size=1000)
+    return len(rows), len(changes), unpriced
+
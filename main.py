@@ -1,110 +1,119 @@
+import psycopg2
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from tkcalendar import DateEntry
 from datetime import date, timedelta
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import csv
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-
-
-def get_conn():
-    return psycopg2.connect(host="localhost", dbname="dairy_management", user="postgres", password="system")
-
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""CREATE TABLE IF NOT EXISTS customers (
-        code SERIAL PRIMARY KEY, name TEXT NOT NULL, doj DATE, phone TEXT, address TEXT, animal_type TEXT);""")
-    cur.execute("""CREATE TABLE IF NOT EXISTS milk_collection (
-        id SERIAL PRIMARY KEY, customer_code INT REFERENCES customers(code), collection_date DATE NOT NULL,
-        session TEXT NOT NULL, animal_type TEXT, quantity_liters FLOAT, fat FLOAT, rate FLOAT, amount FLOAT,
-        CONSTRAINT unique_collection UNIQUE (customer_code, collection_date, session));""")
-    conn.commit()
-    cur.close()
-    conn.close()
-fat_rate_map = {}
-try:
-    with open('fat_rate.csv', newline='') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            fat_rate_map[float(row['Fat'])] = float(row['Rate'])
-except FileNotFoundError:
-    messagebox.showwarning("CSV Missing", "fat_rate.csv not found. Enter rates manually.")
-
-def insert_customer(name, doj, phone, address, animal_type):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO customers (name, doj, phone, address, animal_type) VALUES (%s,%s,%s,%s,%s)",
-                (name, doj, phone, address, animal_type))
-    conn.commit()
-    conn.close()
-
-def fetch_customers():
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT code, name FROM customers ORDER BY code;")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def fetch_customers_full():
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT code, name, doj, phone, address, animal_type FROM customers ORDER BY code;")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def insert_collection(cust_code, collection_date, session, animal_type, qty, fat, rate):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM milk_collection WHERE customer_code=%s AND collection_date=%s AND session=%s",
-                (cust_code, collection_date, session))
-    if cur.fetchone():
-        conn.close()
-        raise Exception(f"{session} entry already exists for this customer on {collection_date}")
-    cur.execute("""INSERT INTO milk_collection (customer_code, collection_date, session, animal_type,
-        quantity_liters, fat, rate, amount) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                (cust_code, collection_date, session, animal_type, qty, fat, rate, qty * rate))
-    conn.commit()
-    conn.close()
-
-def fetch_bill(cust_code, start_date, end_date):
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""SELECT collection_date, session, animal_type, quantity_liters, fat, rate, amount
-        FROM milk_collection WHERE customer_code=%s AND collection_date BETWEEN %s AND %s
-        ORDER BY collection_date;""", (cust_code, start_date, end_date))
-    rows = cur.fetchall()
-    total = sum(r["amount"] for r in rows)
-    conn.close()
-    return rows, total
-
-init_db()
-root = tk.Tk()
-root.title("🥛 Modern Dairy Management")
-root.geometry("700x600")
-root.configure(bg='#1a1a2e')
+from dairy import aggregates, analytics, billing, cache, changes, db, export, importer, journal, ledger, metrics, rates
+from workers import BackgroundRunner
+
+
+root = None
+runner = None
+syncer = None
+feed = None
+watcher = None
+RECENT_LIMIT = 50
+REPORT_RELOAD_MS = 10000
+SCHEMA_RETRY_MS = 30000
 COLORS = { 'primary': '#6c5ce7', 'accent': '#fd79a8', 'success': '#00b894', 'danger': '#e17055',
             'bg_primary': '#1a1a2e', 'bg_card': '#0f3460', 'text_primary': '#ffffff'}
 
-style = ttk.Style()
-style.theme_use('clam')
-style.configure('Modern.TButton', font=('Segoe UI', 11, 'bold'), background=COLORS['primary'],foreground='white', relief='flat', padding=(20, 12))
-style.configure('Success.TButton', background=COLORS['success'], foreground='white', padding=(15, 8))
-style.configure('Danger.TButton', background=COLORS['danger'], foreground='white', padding=(15, 8))
-style.configure('Card.TFrame', background=COLORS['bg_card'], relief='flat', borderwidth=2)
-style.configure('Dark.TFrame', background=COLORS['bg_primary'], relief='flat')
-style.configure('Title.TLabel', background=COLORS['bg_primary'], foreground=COLORS['text_primary'],font=('Segoe UI', 18, 'bold'))
-style.configure('Card.TLabel', background=COLORS['bg_card'], foreground=COLORS['text_primary'])
-style.configure('Modern.TEntry', fieldbackground='white', borderwidth=2, font=('Segoe UI', 10))
-style.configure('Modern.TCombobox', fieldbackground='white', font=('Segoe UI', 10))
-style.configure("Modern.Treeview.Heading", font=('Segoe UI', 10, 'bold'), background=COLORS['primary'],foreground='white', relief='flat')
-style.configure("Modern.Treeview", background='white', fieldbackground='white')
+
+def subscribe(win, source, fn):
+    # Listeners of the syncer / change feed run on their own thread; fn is
+    # called on the Tk thread for as long as win is open.
+    def deliver(*args):
+        if win.winfo_exists():
+            fn(*args)
+
+    def listener(*args):
+        runner.call_soon(deliver, *args)
+    source.add_listener(listener)
+    win.bind("<Destroy>", lambda e: e.widget is win and source.remove_listener(listener), add="+")
+
+
+def sync_status(prefix=""):
+    waiting = syncer.journal.counts().get("pending", 0)
+    state = f"{waiting} waiting to sync" if waiting else "all synced"
+    if not syncer.online:
+        state = f"📴 offline · {state}"
+    return " · ".join(p for p in (prefix, state) if p)
+
+
+def tree_position(tree, key, descending=False):
+    # Index at which an item keyed by int(iid) keeps the tree sorted.
+    keys = [int(iid) for iid in tree.get_children()]
+    if descending:
+        return next((i for i, k in enumerate(keys) if k < key), len(keys))
+    return next((i for i, k in enumerate(keys) if k > key), len(keys))
+
+
+def fill_customer_options(combobox):
+    # Type-ahead: the dropdown holds only the customers matching what has been
+    # typed so far, served from the customer cache without a round trip.
+    state = {"text": None}
+
+    def search():
+        combobox.configure(values=[f"{c['code']} - {c['name']}" for c in cache.customers.search(state["text"])])
+
+    def on_key(event):
+        text = combobox.get()
+        if text == state["text"] or " - " in text:
+            return
+        state["text"] = text
+        search()
+    combobox.bind("<KeyRelease>", on_key, add="+")
+    state["text"] = ""
+    search()
+
+
+def open_diagnostics():
+    win = tk.Toplevel(root)
+    win.title("📈 Diagnostics")
+    win.geometry("1000x500")
+    win.configure(bg=COLORS['bg_primary'])
+    container = ttk.Frame(win, style='Dark.TFrame', padding=20)
+    container.pack(fill='both', expand=True)
+    ttk.Label(container, text="📈 Live Timings", style='Title.TLabel').pack(pady=(0, 15))
+    table_frame = ttk.Frame(container, style='Card.TFrame', padding=15)
+    table_frame.pack(fill='both', expand=True)
+    columns = ("Name", "Count", "Total ms", "Mean ms", "p95 ms", "Max ms", "Rows", "Errors")
+    tree = ttk.Treeview(table_frame, columns=columns, show="headings", style='Modern.Treeview')
+    for col in columns:
+        tree.heading(col, text=col)
+        tree.column(col, width=80, anchor='e')
+    tree.column("Name", width=420, anchor='w')
+    scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=tree.yview)
+    tree.configure(yscrollcommand=scrollbar.set)
+    tree.pack(fill='both', expand=True, side='left')
+    scrollbar.pack(side='right', fill='y')
+    status = ttk.Label(container, text="", style='Title.TLabel', font=('Segoe UI', 10))
+
+    def refresh():
+        if not win.winfo_exists():
+            return
+        for item in tree.get_children():
+            tree.delete(item)
+        for s in metrics.snapshot():
+            tree.insert("", "end", values=(s["name"], s["count"], f"{s['total_ms']:.1f}", f"{s['mean_ms']:.2f}",
+                                           f"{s['p95_ms']:.2f}", f"{s['max_ms']:.2f}", s["rows"], s["errors"]))
+        logs = [h.baseFilename for h in metrics.slow_log.handlers if hasattr(h, "baseFilename")]
+        status.config(text=f"Slow queries (≥ {metrics.SLOW_QUERY_MS:.0f} ms) logged to {logs[0]}" if logs
+                      else "Slow-query log is off")
+        win.after(1000, refresh)
+
+    def enable_log():
+        if not metrics.slow_log.handlers:
+            metrics.enable_slow_log("slow_queries.log")
+
+    button_frame = ttk.Frame(container, style='Dark.TFrame')
+    button_frame.pack(fill='x', pady=10)
+    ttk.Button(button_frame, text="🔄 Reset", command=metrics.reset, style='Modern.TButton').pack(side='left', padx=5)
+    ttk.Button(button_frame, text="📝 Log Slow Queries", command=enable_log,
+               style='Modern.TButton').pack(side='left', padx=5)
+    status.pack(anchor='w')
+    refresh()
+
 
 def open_customer_form():
     win = tk.Toplevel(root)
@@ -141,10 +150,12 @@ def open_customer_form():
             if not name:
                 messagebox.showwarning("⚠️ Input Error", "Customer name is required!")
                 return
-            insert_customer(name, entries['date'].get_date(), entries['phone'].get().strip(),
-                            entries['address'].get().strip(), animal_var.get())
-            messagebox.showinfo("✅ Success", "Customer saved successfully!")
-            win.destroy()
+            def saved(_):
+                messagebox.showinfo("✅ Success", "Customer saved successfully!")
+                win.destroy()
+            runner.submit(None, cache.customers.insert_customer, name, entries['date'].get_date(),
+                          entries['phone'].get().strip(), entries['address'].get().strip(), animal_var.get(),
+                          on_done=saved, widget=win)
         except Exception as ex:
             messagebox.showerror("❌ Error", str(ex))
 
@@ -161,6 +172,13 @@ def open_customer_list():
     container = ttk.Frame(win, style='Dark.TFrame', padding=20)
     container.pack(fill='both', expand=True)
     ttk.Label(container, text="👥 Customer Directory", style='Title.TLabel').pack(pady=(0, 20))
+    search_frame = ttk.Frame(container, style='Card.TFrame', padding=10)
+    search_frame.pack(fill='x', pady=(0, 10))
+    ttk.Label(search_frame, text="🔍 Search code, name or phone:", style='Card.TLabel').pack(side='left', padx=5)
+    search_entry = ttk.Entry(search_frame, style='Modern.TEntry', width=30)
+    search_entry.pack(side='left', padx=5)
+    count_label = ttk.Label(search_frame, text="", style='Card.TLabel')
+    count_label.pack(side='right', padx=5)
     table_frame = ttk.Frame(container, style='Card.TFrame', padding=15)
     table_frame.pack(fill='both', expand=True)
     columns = ("Code", "Name", "DOJ", "Phone", "Address", "Animal")
@@ -169,16 +187,74 @@ def open_customer_list():
         tree.heading(col, text=col)
         tree.column(col, width=120)
     scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=tree.yview)
-    tree.configure(yscrollcommand=scrollbar.set)
     tree.pack(fill='both', expand=True, side='left')
     scrollbar.pack(side='right', fill='y')
 
-    def load_data():
-        for item in tree.get_children():
-            tree.delete(item)
-        customers = fetch_customers_full()
+    # Pages are fetched by keyset (code > last code shown) as the list is
+    # scrolled towards its end, so only what has been looked at is loaded.
+    state = {"search": "", "last": 0, "done": False, "loading": False}
+
+    def values_for(c):
+        return (c["code"], c["name"], c["doj"], c["phone"], c["address"], c["animal_type"])
+
+    def show_page(customers):
+        state["loading"] = False
+        state["done"] = len(customers) < db.CUSTOMER_PAGE
         for c in customers:
-            tree.insert("", "end", values=(c["code"], c["name"], c["doj"], c["phone"], c["address"], c["animal_type"]))
+            tree.insert("", "end", iid=c["code"], values=values_for(c))
+        if customers:
+            state["last"] = customers[-1]["code"]
+        count_label.config(text=f"{len(tree.get_children())} shown" + ("" if state["done"] else ", scroll for more"))
+
+    def load_page():
+        state["loading"] = True
+        runner.submit((str(win), "page"), db.fetch_customer_page, state["last"], state["search"],
+                      on_done=show_page, on_error=page_failed, widget=win, metric="ui.customer_list.load_page")
+
+    def page_failed(ex):
+        state["loading"] = False
+        messagebox.showerror("❌ Error", str(ex), parent=win)
+
+    def load_data():
+        tree.delete(*tree.get_children())
+        state.update(search=search_entry.get().strip(), last=0, done=False)
+        load_page()
+
+    def on_scroll(first, last):
+        scrollbar.set(first, last)
+        if float(last) > 0.9 and not state["done"] and not state["loading"]:
+            load_page()
+    tree.configure(yscrollcommand=on_scroll)
+
+    def on_search_key(event):
+        if search_entry.get().strip() == state["search"]:
+            return
+        if state.get("after"):
+            win.after_cancel(state["after"])
+        state["after"] = win.after(300, searched)
+
+    def searched():
+        state["after"] = None
+        load_data()
+    search_entry.bind("<KeyRelease>", on_search_key)
+
+    def apply_changes(changed, removed):
+        for code in removed:
+            if tree.exists(code):
+                tree.delete(code)
+        for c in changed:
+            if tree.exists(c["code"]):
+                tree.item(c["code"], values=values_for(c))
+            elif not state["search"] and (state["done"] or c["code"] < state["last"]):
+                # Rows past the last loaded page arrive with the page itself.
+                tree.insert("", tree_position(tree, c["code"]), iid=c["code"], values=values_for(c))
+
+    def on_change(table, op, keys):
+        # Changed codes are re-read once by the app-wide listener in main(), which hands them to apply_changes.
+        if table is None or (table == "customers" and keys is None):
+            load_data()
+    subscribe(win, feed, on_change)
+    subscribe(win, cache.customers, apply_changes)
     ttk.Button(container, text="🔄 Refresh", command=load_data, style='Modern.TButton').pack(pady=10)
     load_data()
 
@@ -194,9 +270,7 @@ def open_collection_form():
     content_frame.pack(fill='both', expand=True)
     form_panel = ttk.Frame(content_frame, style='Card.TFrame', padding=20)
     form_panel.pack(side='left', fill='y', padx=(0, 15))
-    customers = fetch_customers()
-    customer_options = [f"{c['code']} - {c['name']}" for c in customers]
-    form_fields = [ ("👤 Customer", "combobox", customer_options),
+    form_fields = [ ("👤 Customer", "combobox", []),
                     ("📅 Date", "date", None),
                     ("🌅 Session", "combobox", ["Morning", "Evening"]),
                     ("🥛 Quantity (L)", "entry", None),
@@ -220,15 +294,37 @@ def open_collection_form():
     for text, value in [("🐄 Cow", "Cow"), ("🐃 Buffalo", "Buffalo")]:
         ttk.Radiobutton(animal_frame, text=text, variable=animal_var, value=value).pack(anchor='w')
 
-    def update_rate(*args):
+    # The last suggested rate and the chart version behind it; a rate typed over it is saved as manual.
+    # The suggestion is debounced so a burst of keystrokes costs one lookup.
+    suggestion = {"after": None, "rate": None, "chart": None}
+
+    def update_rate():
+        suggestion["after"] = None
         try:
-            fat_val = round(float(entries['fat'].get()), 1)
-            if fat_val in fat_rate_map:
-                entries['rate'].delete(0, tk.END)
-                entries['rate'].insert(0, str(fat_rate_map[fat_val]))
+            rate, chart = rates.suggest(entries['fat'].get(), animal_var.get(), entries['date'].get_date())
         except ValueError:
-            pass
-    entries['fat'].bind("<KeyRelease>", update_rate)
+            return
+        if rate is not None:
+            entries['rate'].delete(0, tk.END)
+            entries['rate'].insert(0, str(rate))
+            suggestion.update(rate=str(rate), chart=chart)
+
+    def schedule_rate(*args):
+        if suggestion["after"]:
+            win.after_cancel(suggestion["after"])
+        suggestion["after"] = win.after(150, update_rate)
+
+    def rate_chart():
+        return suggestion["chart"] if entries['rate'].get().strip() == suggestion["rate"] else rates.MANUAL_RATE
+
+    def charts_reloaded(book, error):
+        # Re-price the reading being entered only while it shows an untouched suggestion;
+        # typed rates and rates loaded from a selected row are left alone.
+        if book is not None and suggestion["chart"] is not None and rate_chart() == suggestion["chart"]:
+            update_rate()
+    entries['fat'].bind("<KeyRelease>", schedule_rate)
+    subscribe(win, watcher, charts_reloaded)
+    fill_customer_options(entries['customer'])
     table_panel = ttk.Frame(content_frame, style='Card.TFrame', padding=15)
     table_panel.pack(side='right', fill='both', expand=True)
     columns = ("ID", "Customer", "Date", "Session", "Qty", "Fat", "Rate", "Amount")
@@ -250,8 +346,12 @@ def open_collection_form():
             entries[key].delete(0, tk.END)
         try:
             customer_code = item_values[1]
-            customer_name = get_customer_name(customer_code)
-            entries['customer'].set(f"{customer_code} - {customer_name}")
+            if cache.customers.get(customer_code):
+                entries['customer'].set(f"{customer_code} - {cache.customers.name(customer_code)}")
+            else:
+                entries['customer'].set(f"{customer_code} - ...")
+                runner.submit((str(win), "select"), db.get_customer_name, customer_code, widget=win,
+                              on_done=lambda name: entries['customer'].set(f"{customer_code} - {name}"))
             date_value = item_values[2]
             print(f"Retrieved date: {date_value}")  # Debugging output
             if isinstance(date_value, str):
@@ -267,29 +367,62 @@ def open_collection_form():
             entries['quantity'].insert(0, item_values[5])
             entries['fat'].insert(0, item_values[6])
             entries['rate'].insert(0, item_values[7])
+            # An untouched rate keeps the chart version the row already records.
+            suggestion.update(rate=entries['rate'].get().strip(), chart=None)
         except Exception as e:
             print(f"Error populating form: {e}")
 
-    def get_customer_name(code):
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM customers WHERE code = %s", (code,))
-        name = cur.fetchone()
-        conn.close()
-        return name[0] if name else "Unknown"
     tree.bind('<<TreeviewSelect>>', on_tree_select)
 
-    def load_data():
+    def values_for(r):
+        return (r["id"], r["customer_code"], r["collection_date"],r["session"], r["animal_type"],
+                r["quantity_liters"], r["fat"], r["rate"],f"₹{r['amount']:.2f}")
+
+    def show_collections(rows):
         for item in tree.get_children():
             tree.delete(item)
-        conn = get_conn()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT * FROM milk_collection ORDER BY id DESC LIMIT 50;")
-        rows = cur.fetchall()
-        conn.close()
         for r in rows:
-            tree.insert("", "end", values=(r["id"], r["customer_code"], r["collection_date"],r["session"], r["animal_type"],
-                                           r["quantity_liters"], r["fat"], r["rate"],f"₹{r['amount']:.2f}"))
+            tree.insert("", "end", iid=r["id"], values=values_for(r))
+
+    # Writes and change notifications touch only the affected rows; the
+    # table keeps the RECENT_LIMIT newest readings, newest first.
+    def upsert_rows(rows):
+        for r in rows:
+            if tree.exists(r["id"]):
+                tree.item(r["id"], values=values_for(r))
+                continue
+            index = tree_position(tree, r["id"], descending=True)
+            if index < RECENT_LIMIT:
+                tree.insert("", index, iid=r["id"], values=values_for(r))
+        for iid in tree.get_children()[RECENT_LIMIT:]:
+            tree.delete(iid)
+
+    def remove_rows(ids):
+        for collection_id in ids:
+            if tree.exists(collection_id):
+                tree.delete(collection_id)
+
+    def load_data():
+        runner.submit((str(win), "load"), db.fetch_recent_collections, RECENT_LIMIT, on_done=show_collections,
+                      widget=win, metric="ui.load_data")
+
+    def on_change(table, op, keys):
+        if table is None or (table == "milk_collection" and keys is None):
+            load_data()
+        elif table == "milk_collection" and op == "DELETE":
+            remove_rows(keys)
+        elif table == "milk_collection":
+            if op == "UPDATE":
+                keys = [k for k in keys if tree.exists(k)]
+            if keys:
+                runner.submit(None, db.fetch_collections, keys, on_done=upsert_rows, metric="ui.apply_changes")
+    subscribe(win, feed, on_change)
+
+    def saved(message, apply):
+        def done(result):
+            apply(result)
+            messagebox.showinfo("✅ Success", message, parent=win)
+        return done
 
     def save_collection():
         try:
@@ -298,14 +431,33 @@ def open_collection_form():
                 messagebox.showwarning("⚠️ Error", "Select a customer!")
                 return
             cust_code = int(customer_text.split(' - ')[0])
-            insert_collection(cust_code, entries['date'].get_date(), entries['session'].get(),
-                              animal_var.get(), float(entries['quantity'].get()),
-                              float(entries['fat'].get()), float(entries['rate'].get()))
-            messagebox.showinfo("✅ Success", "Collection saved!")
-            load_data()
+            # Committed to the local journal right away; the syncer pushes it to the server.
+            with metrics.timer("ui.save_collection"):
+                saved_ids.add(syncer.journal.append(cust_code, entries['date'].get_date(), entries['session'].get(),
+                                      animal_var.get(), float(entries['quantity'].get()),
+                                      float(entries['fat'].get()), float(entries['rate'].get()), rate_chart()))
+            show_sync_status(f"✅ Saved {cust_code} ({entries['session'].get()})")
+            syncer.wake()
         except Exception as ex:
             messagebox.showerror("❌ Error", str(ex))
 
+    def show_sync_status(prefix=""):
+        status_label.config(text=sync_status(prefix))
+
+    saved_ids = set()
+
+    def sync_done(outcomes):
+        show_sync_status()
+        synced = [o[2] for o in outcomes if o[1] == "synced"]
+        if synced and not feed.connected:
+            runner.submit(None, db.fetch_collections, synced, on_done=upsert_rows)
+        # Only readings saved from this form; session entry reports its own.
+        problems = [o[3] for o in outcomes if o[1] != "synced" and o[0] in saved_ids]
+        saved_ids.difference_update(o[0] for o in outcomes)
+        if problems:
+            messagebox.showwarning("⚠️ Not Synced", "\n".join(problems[:20]), parent=win)
+    subscribe(win, syncer, sync_done)
+
     def update_collection():
         try:
             selected_item = tree.selection()
@@ -323,20 +475,14 @@ def open_collection_form():
             except ValueError:
                 messagebox.showerror("❌ Error", "Invalid customer code selected!")
                 return
-            update_query = """UPDATE milk_collection SET customer_code=%s, collection_date=%s, session=%s,
-                              animal_type=%s, quantity_liters=%s, fat=%s, rate=%s, amount=%s WHERE id=%s"""
             quantity = float(entries['quantity'].get())
             fat = float(entries['fat'].get())
             rate = float(entries['rate'].get())
-            amount = quantity * rate
-            conn = get_conn()
-            cur = conn.cursor()
-            cur.execute(update_query, (cust_code, entries['date'].get_date(), entries['session'].get(),
-                                       animal_var.get(), quantity, fat, rate, amount, collection_id))
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("✅ Success", "Collection updated!")
-            load_data()  # Refresh the data after updating
+            runner.submit(None, db.update_collection, collection_id, cust_code,
+                          entries['date'].get_date(), entries['session'].get(), animal_var.get(), quantity, fat, rate,
+                          rate_chart(), on_done=saved("Collection updated!", lambda row: upsert_rows([row]) if row
+                                        else remove_rows([collection_id])),
+                          widget=win, metric="ui.update_collection")
         except Exception as ex:
             messagebox.showerror("❌ Error", str(ex))
 
@@ -347,25 +493,193 @@ def open_collection_form():
                 messagebox.showwarning("⚠️ Error", "Select a record to delete!")
                 return
             collection_id = tree.item(selected_item)['values'][0]
-            conn = get_conn()
-            cur = conn.cursor()
-            cur.execute("DELETE FROM milk_collection WHERE id=%s", (collection_id,))
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("✅ Success", "Collection deleted!")
-            load_data()
+            runner.submit(None, db.delete_collection, collection_id,
+                          on_done=saved("Collection deleted!", lambda _: remove_rows([collection_id])),
+                          widget=win, metric="ui.delete_collection")
         except Exception as ex:
             messagebox.showerror("❌ Error", str(ex))
 
+    def import_csv():
+        path = filedialog.askopenfilename(parent=win, title="Import collection CSV",
+                                          filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not path:
+            return
+
+        def imported(summary):
+            messagebox.showinfo("📥 Import Complete", summary.report(), parent=win)
+            if not feed.connected:
+                load_data()
+        runner.submit(None, importer.import_collections, path, default_animal=animal_var.get(),
+                      on_done=imported, widget=win)
+
     button_frame = ttk.Frame(container, style='Dark.TFrame')
     button_frame.pack(fill='x', pady=20)
     ttk.Button(button_frame, text="💾 Save", command=save_collection, style='Success.TButton').pack(side='left', padx=5)
     ttk.Button(button_frame, text="🔄 Refresh", command=load_data, style='Modern.TButton').pack(side='left', padx=5)
     ttk.Button(button_frame, text="✏️ Update", command=update_collection, style='Modern.TButton').pack(side='left', padx=5)
     ttk.Button(button_frame, text="🗑️ Delete", command=delete_collection, style='Danger.TButton').pack(side='left', padx=5)
+    ttk.Button(button_frame, text="📥 Import CSV", command=import_csv, style='Modern.TButton').pack(side='left', padx=5)
+
+    def session_entry():
+        if not entries['session'].get():
+            messagebox.showwarning("⚠️ Error", "Select a session first!", parent=win)
+            return
+        open_session_entry(entries['date'].get_date(), entries['session'].get())
+    ttk.Button(button_frame, text="⚡ Session Entry", command=session_entry,
+               style='Success.TButton').pack(side='left', padx=5)
+    status_label = ttk.Label(container, text="", style='Title.TLabel', font=('Segoe UI', 10))
+    status_label.pack(fill='x')
 
+    show_sync_status()
     load_data()
 
+def open_session_entry(collection_date, session):
+    # Rush-hour entry: date and session are fixed, the operator types
+    # code -> quantity -> fat with Enter, and every reading is checked and
+    # priced locally before going to the journal. The syncer then commits
+    # whatever has accumulated every few seconds as one batch.
+    win = tk.Toplevel(root)
+    win.title(f"⚡ {session} Session · {collection_date}")
+    win.geometry("820x600")
+    win.configure(bg=COLORS['bg_primary'])
+    container = ttk.Frame(win, style='Dark.TFrame', padding=20)
+    container.pack(fill='both', expand=True)
+    ttk.Label(container, text=f"⚡ {session} Session · {collection_date}", style='Title.TLabel').pack(pady=(0, 15))
+    entry_frame = ttk.Frame(container, style='Card.TFrame', padding=15)
+    entry_frame.pack(fill='x')
+    fields = {}
+    for i, (key, label, width) in enumerate([("code", "👤 Code", 8), ("quantity", "🥛 Qty (L)", 8),
+                                             ("fat", "🧈 Fat %", 8)]):
+        ttk.Label(entry_frame, text=label, style='Card.TLabel').grid(row=0, column=i * 2, padx=5)
+        fields[key] = ttk.Entry(entry_frame, style='Modern.TEntry', width=width, font=('Segoe UI', 14))
+        fields[key].grid(row=0, column=i * 2 + 1, padx=5)
+    animal_var = tk.StringVar(value="Cow")
+    for i, (text, value) in enumerate([("🐄 Cow", "Cow"), ("🐃 Buffalo", "Buffalo")]):
+        ttk.Radiobutton(entry_frame, text=text, variable=animal_var, value=value,
+                        takefocus=False).grid(row=0, column=6 + i, padx=5)
+    name_label = ttk.Label(entry_frame, text="", style='Card.TLabel', font=('Segoe UI', 11, 'bold'))
+    name_label.grid(row=1, column=0, columnspan=8, sticky='w', padx=5, pady=(8, 0))
+
+    table_frame = ttk.Frame(container, style='Card.TFrame', padding=15)
+    table_frame.pack(fill='both', expand=True, pady=10)
+    columns = ("Code", "Name", "Animal", "Qty", "Fat", "Rate", "Amount", "Status")
+    tree = ttk.Treeview(table_frame, columns=columns, show="headings", style='Modern.Treeview')
+    for col in columns:
+        tree.heading(col, text=col)
+        tree.column(col, width=85)
+    scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=tree.yview)
+    tree.configure(yscrollcommand=scrollbar.set)
+    tree.pack(fill='both', expand=True, side='left')
+    scrollbar.pack(side='right', fill='y')
+    totals_label = ttk.Label(container, text="", style='Title.TLabel', font=('Segoe UI', 11))
+    totals_label.pack(fill='x')
+    status_label = ttk.Label(container, text="", style='Title.TLabel', font=('Segoe UI', 10))
+    status_label.pack(fill='x')
+    state = {"readings": 0, "liters": 0.0, "amount": 0.0, "message": ""}
+
+    def show_status(message=None):
+        if message is not None:
+            state["message"] = message
+        status_label.config(text=sync_status(state["message"]))
+        totals_label.config(text=f"{state['readings']} readings · {state['liters']:.1f} L · "
+                                 f"₹{state['amount']:.2f}")
+
+    def reject(field, message):
+        show_status(f"⚠️ {message}")
+        fields[field].focus_set()
+        fields[field].select_range(0, tk.END)
+
+    def code_entered(event=None):
+        text = fields['code'].get().strip()
+        customer = cache.customers.get(text) if text.isdigit() else None
+        if customer is None:
+            name_label.config(text="")
+            return reject('code', f"Unknown customer code {text!r}")
+        name_label.config(text=customer["name"])
+        if customer["animal_type"] in ("Cow", "Buffalo"):
+            animal_var.set(customer["animal_type"])
+        fields['quantity'].focus_set()
+
+    def read_quantity():
+        # Same bound as the journal, so a bad quantity is caught on its own field.
+        qty = float(fields['quantity'].get())
+        if not 0 < qty <= journal.MAX_QUANTITY:
+            raise ValueError
+        return qty
+
+    def quantity_entered(event=None):
+        try:
+            read_quantity()
+        except ValueError:
+            return reject('quantity', f"Quantity must be a number between 0 and {journal.MAX_QUANTITY:g} L")
+        fields['fat'].focus_set()
+
+    def fat_entered(event=None):
+        text = fields['code'].get().strip()
+        customer = cache.customers.get(text) if text.isdigit() else None
+        if customer is None:
+            return reject('code', f"Unknown customer code {text!r}")
+        try:
+            qty = read_quantity()
+        except ValueError:
+            return reject('quantity', f"Quantity must be a number between 0 and {journal.MAX_QUANTITY:g} L")
+        try:
+            fat = float(fields['fat'].get())
+        except ValueError:
+            return reject('fat', "Fat must be a number")
+        try:
+            # The rate follows from the fat, so an out-of-range one is put right there too.
+            rate, chart = rates.quote(animal_var.get(), collection_date, fat)
+            journal.check_reading(qty, fat, rate)
+        except ValueError as ex:
+            return reject('fat', str(ex))
+        try:
+            with metrics.timer("ui.session_entry"):
+                jid = syncer.journal.append(customer["code"], collection_date, session, animal_var.get(),
+                                            qty, fat, rate, chart)
+        except Exception as ex:
+            return reject('code', str(ex))
+        tree.insert("", 0, iid=jid, values=(customer["code"], customer["name"], animal_var.get(), qty, fat,
+                                            f"{rate:.2f}", f"₹{qty * rate:.2f}", "⏳ pending"))
+        state["readings"] += 1
+        state["liters"] += qty
+        state["amount"] += qty * rate
+        for field in fields.values():
+            field.delete(0, tk.END)
+        name_label.config(text="")
+        fields['code'].focus_set()
+        show_status(f"✅ {customer['code']} {customer['name']}: {qty:g} L @ ₹{rate:.2f}")
+
+    def clear(event=None):
+        for field in fields.values():
+            field.delete(0, tk.END)
+        name_label.config(text="")
+        fields['code'].focus_set()
+
+    fields['code'].bind("<Return>", code_entered)
+    fields['quantity'].bind("<Return>", quantity_entered)
+    fields['fat'].bind("<Return>", fat_entered)
+    win.bind("<Escape>", clear)
+
+    def sync_done(outcomes):
+        problems = []
+        for jid, status, _, error in outcomes:
+            if not tree.exists(jid):
+                continue
+            tree.set(jid, "Status", "✅ synced" if status == "synced" else f"⚠️ {status}")
+            if status != "synced":
+                problems.append(error)
+                values = tree.item(jid)['values']
+                state["readings"] -= 1
+                state["liters"] -= float(values[3])
+                state["amount"] -= float(values[3]) * float(values[5])
+        show_status(f"⚠️ {problems[0]}" + (f" (+{len(problems) - 1} more)" if len(problems) > 1 else "")
+                    if problems else None)
+    subscribe(win, syncer, sync_done)
+    show_status()
+    fields['code'].focus_set()
+
+
 def open_bill_form():
     win = tk.Toplevel(root)
     win.title("🧾 Bill Generation")
@@ -380,12 +694,10 @@ def open_bill_form():
     control_frame = ttk.Frame(container, style='Card.TFrame', padding=15)
     control_frame.pack(fill='x', pady=(0, 15))
 
-    customers = fetch_customers()
-    customer_options = [f"{c['code']} - {c['name']}" for c in customers]
-
     ttk.Label(control_frame, text="👤 Customer:", style='Card.TLabel').grid(row=0, column=0, padx=10, pady=10)
-    cb_code = ttk.Combobox(control_frame, values=customer_options, style='Modern.TCombobox', width=25)
+    cb_code = ttk.Combobox(control_frame, values=[], style='Modern.TCombobox', width=25)
     cb_code.grid(row=0, column=1, padx=10)
+    fill_customer_options(cb_code)
 
     ttk.Label(control_frame, text="📅 From:", style='Card.TLabel').grid(row=0, column=2, padx=10)
     start_date = DateEntry(control_frame, width=12, background=COLORS['primary'], foreground='white')
@@ -413,6 +725,9 @@ def open_bill_form():
 
     total_label = ttk.Label(container, text="Total: ₹0.00", style='Title.TLabel')
     total_label.pack(pady=10)
+    summary_label = ttk.Label(container, text="", style='Title.TLabel', font=('Segoe UI', 11))
+    summary_label.pack()
+    current_bill = {}
 
     def generate_bill():
         try:
@@ -420,16 +735,28 @@ def open_bill_form():
                 messagebox.showwarning("⚠️ Error", "Select a customer!")
                 return
             cust_code = int(cb_code.get().split(' - ')[0])
-            rows, total = fetch_bill(cust_code, start_date.get_date(), end_date.get_date())
-
-            for item in tree.get_children():
-                tree.delete(item)
-            for r in rows:
-                tree.insert("", "end", values=(r["collection_date"], r["session"], r["animal_type"],
-                                               r["quantity_liters"], f"{r['fat']}%", f"₹{r['rate']:.2f}", f"₹{r['amount']:.2f}"))
-            total_label.config(text=f"Total: ₹{total:.2f}")
-            if not rows:
-                messagebox.showinfo("ℹ️ No Data", "No records found for the selected period!")
+            bill_range = (cust_code, start_date.get_date(), end_date.get_date())
+
+            def show_bill(result):
+                rows, total = result
+                current_bill.update(range=bill_range, rows=rows, total=total)
+                for item in tree.get_children():
+                    tree.delete(item)
+                for r in rows:
+                    tree.insert("", "end", values=(r["collection_date"], r["session"], r["animal_type"],
+                                                   r["quantity_liters"], f"{r['fat']}%", f"₹{r['rate']:.2f}", f"₹{r['amount']:.2f}"))
+                total_label.config(text=f"Total: ₹{total:.2f}")
+                if not rows:
+                    messagebox.showinfo("ℹ️ No Data", "No records found for the selected period!", parent=win)
+            current_bill.clear()
+            runner.submit((str(win), "bill"), ledger.get_bill, *bill_range, on_done=show_bill, widget=win,
+                          metric="ui.generate_bill")
+
+            def show_totals(totals):
+                summary_label.config(text=f"{totals['liters']:.2f} L ({totals['morning_liters']:.2f} morning, "
+                                          f"{totals['evening_liters']:.2f} evening) · avg fat {totals['avg_fat']:.2f}%")
+            runner.submit((str(win), "bill_totals"), aggregates.fetch_customer_totals, *bill_range,
+                          on_done=show_totals, widget=win)
         except Exception as ex:
             messagebox.showerror("❌ Error", str(ex))
 
@@ -444,54 +771,80 @@ def open_bill_form():
                 return
             cust_code = int(cb_code.get().split(' - ')[0])
             customer_name = cb_code.get().split(' - ')[1]
-            rows, total = fetch_bill(cust_code, start_date.get_date(), end_date.get_date())
-
-            filename = f"Bill_{customer_name.replace(' ', '_')}_{start_date.get_date()}_{end_date.get_date()}.pdf"
-
-            doc = SimpleDocTemplate(filename, pagesize=A4)
-            story = []
-            styles = getSampleStyleSheet()
-
-            # Header
-            story.append(Paragraph("<b> Patil Milk Products Pvt. Ltd.</b>", styles['Title']))
-            story.append(Paragraph("Milk Bill", styles['Heading2']))
-            story.append(Spacer(1, 12))
-
-            # Customer Info
-            story.append(Paragraph(f"<b>Customer:</b> {customer_name}", styles['Normal']))
-            story.append(Paragraph(f"<b>Bill From:</b> {start_date.get_date()}  <b>To:</b> {end_date.get_date()}",
-                                   styles['Normal']))
-            story.append(Spacer(1, 12))
-
-            # Table
-            data = [["Date", "Session", "Animal", "Qty (L)", "Fat %", "Rate (₹)", "Amount (₹)"]]
-            for r in rows:
-                data.append([
-                    str(r["collection_date"]), r["session"], r["animal_type"],
-                    f"{r['quantity_liters']:.2f}", f"{r['fat']:.1f}",
-                    f"{r['rate']:.2f}", f"{r['amount']:.2f}"
-                ])
-            data.append(["", "", "", "", "", "Total", f"{total:.2f}"])
-
-            table = Table(data, colWidths=[70, 60, 70, 60, 60, 60, 80])
-            table.setStyle(TableStyle([
-                ("BACKGROUND", (0, 0), (-1, 0), colors.lightblue),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.black),
-                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
-                ("BACKGROUND", (0, 1), (-1, -1), colors.whitesmoke),
-            ]))
-            story.append(table)
-
-            story.append(Spacer(1, 20))
-            story.append(Paragraph(f"<b>Net Payable Amount:</b> ₹{total:.2f}", styles['Heading2']))
-
-            doc.build(story)
-
-            messagebox.showinfo("✅ Bill Printed", f"Bill saved as PDF: {filename}")
+            bill_range = (cust_code, start_date.get_date(), end_date.get_date())
+            cached = dict(current_bill) if current_bill.get("range") == bill_range else None
+            filename = billing.bill_filename(customer_name, start_date.get_date(), end_date.get_date())
+
+            def render():
+                rows, total = (cached["rows"], cached["total"]) if cached else (None, None)
+                return ledger.print_bill(cust_code, customer_name, bill_range[1], bill_range[2], filename,
+                                         rows, total)
+            runner.submit((str(win), "print"), render, widget=win, metric="ui.print_bill",
+                          on_done=lambda f: messagebox.showinfo("✅ Bill Printed", f"Bill saved as PDF: {f}",
+                                                                parent=win))
         except Exception as ex:
             messagebox.showerror("❌ Error", str(ex))
 
+    # ---- Bill all customers ----
+    def bill_all_customers():
+        out_dir = filedialog.askdirectory(parent=win, title="Folder for bill PDFs")
+        if not out_dir:
+            return
+        period = (start_date.get_date(), end_date.get_date())
+        combined = combined_var.get()
+
+        def progress(done, total, filename):
+            runner.call_soon(show_progress, done, total)
+
+        def show_progress(done, total):
+            batch_progress.configure(maximum=total, value=done)
+            batch_status.config(text=f"Rendered {done} of {total} bills")
+
+        def finished(files):
+            batch_status.config(text=f"{len(files)} PDF(s) written to {out_dir}")
+            messagebox.showinfo("✅ Bills Printed", f"{len(files)} PDF(s) saved in {out_dir}", parent=win)
+
+        def failed(ex):
+            batch_status.config(text="Batch billing failed")
+            messagebox.showerror("❌ Error", str(ex), parent=win)
+
+        batch_progress.configure(value=0)
+        batch_status.config(text="Fetching collections for all customers...")
+        runner.submit((str(win), "batch"), ledger.run_bill_batch, *period, out_dir=out_dir, combined=combined,
+                      progress=progress, on_done=finished, on_error=failed, widget=win)
+
+    # ---- Export range ----
+    def export_range():
+        # With no customer selected the whole range is exported for everyone.
+        try:
+            cust_code = int(cb_code.get().split(' - ')[0]) if cb_code.get().strip() else None
+        except ValueError:
+            messagebox.showwarning("⚠️ Error", "Pick a customer from the list, or clear it to export everyone!",
+                                   parent=win)
+            return
+        path = filedialog.asksaveasfilename(parent=win, title="Export collections", defaultextension=".csv",
+                                            filetypes=[("CSV files", "*.csv"), ("PDF statement", "*.pdf")])
+        if not path:
+            return
+
+        def progress(count):
+            runner.call_soon(show_count, count)
+
+        def show_count(count):
+            batch_status.config(text=f"Exported {count} rows...")
+
+        def finished(result):
+            count, total = result
+            batch_status.config(text=f"{count} rows (₹{total:.2f}) exported to {path}")
+
+        def failed(ex):
+            batch_status.config(text="Export failed")
+            messagebox.showerror("❌ Error", str(ex), parent=win)
+
+        batch_status.config(text="Exporting...")
+        runner.submit((str(win), "export"), export.export_range, path, start_date.get_date(), end_date.get_date(),
+                      cust_code, progress, on_done=finished, on_error=failed, widget=win, metric="ui.export")
+
     # ---- Buttons ----
     button_frame = ttk.Frame(control_frame, style='Card.TFrame')
     button_frame.grid(row=1, column=0, columnspan=6, pady=15)
@@ -499,14 +852,223 @@ def open_bill_form():
                style='Success.TButton').pack(side='left', padx=10)
     ttk.Button(button_frame, text="🖨️ Print to PDF", command=print_bill,
                style='Modern.TButton').pack(side='left', padx=10)
-main_frame = ttk.Frame(root, style='Dark.TFrame', padding=40)
-main_frame.pack(fill='both', expand=True)
-ttk.Label(main_frame, text="🥛 Modern Dairy Management", style='Title.TLabel').pack(pady=(0, 30))
-menu_buttons = [    ("👤 Customer Registration", open_customer_form, 'Success.TButton'),
-                    ("👥 Customer Directory", open_customer_list, 'Modern.TButton'),
-                    ("🥛 Milk Collection", open_collection_form, 'Modern.TButton'),
-                    ("🧾 Bill Generation", open_bill_form, 'Modern.TButton'),
-                    ("🚪 Exit", root.destroy, 'Danger.TButton') ]
-for text, command, style in menu_buttons:
-    ttk.Button(main_frame, text=text, command=command, style=style).pack(fill='x', pady=8, padx=20)
-root.mainloop()
\ No newline at end of file
+    ttk.Button(button_frame, text="📦 Bill All Customers", command=bill_all_customers,
+               style='Modern.TButton').pack(side='left', padx=10)
+    ttk.Button(button_frame, text="📤 Export Range", command=export_range,
+               style='Modern.TButton').pack(side='left', padx=10)
+    combined_var = tk.BooleanVar(value=False)
+    ttk.Checkbutton(button_frame, text="Single combined PDF", variable=combined_var).pack(side='left', padx=10)
+    batch_progress = ttk.Progressbar(control_frame, mode='determinate')
+    batch_progress.grid(row=2, column=0, columnspan=6, sticky='ew', padx=10)
+    batch_status = ttk.Label(control_frame, text="", style='Card.TLabel')
+    batch_status.grid(row=3, column=0, columnspan=6, pady=(5, 0))
+
+
+def open_analytics():
+    win = tk.Toplevel(root)
+    win.title("📊 Analytics")
+    win.geometry("1000x600")
+    win.configure(bg=COLORS['bg_primary'])
+    container = ttk.Frame(win, style='Dark.TFrame', padding=20)
+    container.pack(fill='both', expand=True)
+    ttk.Label(container, text="📊 Analytics", style='Title.TLabel').pack(pady=(0, 15))
+
+    control_frame = ttk.Frame(container, style='Card.TFrame', padding=15)
+    control_frame.pack(fill='x', pady=(0, 15))
+    titles = {title: name for name, (title, _, _) in analytics.REPORTS.items()}
+    ttk.Label(control_frame, text="📈 Report:", style='Card.TLabel').grid(row=0, column=0, padx=10, pady=10)
+    report_var = tk.StringVar(value=analytics.REPORTS["days"][0])
+    ttk.Combobox(control_frame, textvariable=report_var, values=list(titles), state='readonly',
+                 style='Modern.TCombobox', width=32).grid(row=0, column=1, padx=10)
+    ttk.Label(control_frame, text="📅 From:", style='Card.TLabel').grid(row=0, column=2, padx=10)
+    start_date = DateEntry(control_frame, width=12, background=COLORS['primary'], foreground='white')
+    start_date.set_date(date.today() - timedelta(days=30))
+    start_date.grid(row=0, column=3, padx=10)
+    ttk.Label(control_frame, text="📅 To:", style='Card.TLabel').grid(row=0, column=4, padx=10)
+    end_date = DateEntry(control_frame, width=12, background=COLORS['primary'], foreground='white')
+    end_date.set_date(date.today())
+    end_date.grid(row=0, column=5, padx=10)
+
+    table_frame = ttk.Frame(container, style='Card.TFrame', padding=15)
+    table_frame.pack(fill='both', expand=True)
+    tree = ttk.Treeview(table_frame, show="headings", style='Modern.Treeview')
+    scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=tree.yview)
+    tree.configure(yscrollcommand=scrollbar.set)
+    tree.pack(fill='both', expand=True, side='left')
+    scrollbar.pack(side='right', fill='y')
+    status = ttk.Label(container, text="", style='Title.TLabel', font=('Segoe UI', 10))
+    status.pack(pady=(10, 0))
+    shown = {}
+    state = {"after": None}
+
+    def period():
+        return titles[report_var.get()], start_date.get_date(), end_date.get_date()
+
+    def show_report(result):
+        report, start, end, rows = result
+        columns = analytics.REPORTS[report][1]
+        tree.delete(*tree.get_children())
+        tree.configure(columns=columns)
+        for col in columns:
+            tree.heading(col, text=col.replace("_", " ").title())
+            tree.column(col, width=160 if col == "name" else 100, anchor='w' if col == "name" else 'e')
+        for r in rows:
+            tree.insert("", "end", values=[analytics.format_value(r[c]) for c in columns])
+        shown.update(report=report, start=start, end=end, rows=rows)
+        status.config(text=f"{len(rows)} row(s) · {start} to {end}")
+
+    def load_report(*args):
+        report, start, end = period()
+        status.config(text="Loading...")
+        runner.submit((str(win), "report"), lambda: (report, start, end, analytics.reports.get(report, start, end)),
+                      on_done=show_report, widget=win, metric="ui.analytics")
+
+    def export_report():
+        if not shown:
+            messagebox.showwarning("⚠️ Warning", "Load a report first", parent=win)
+            return
+        path = filedialog.asksaveasfilename(parent=win, title="Export report", defaultextension=".csv",
+                                            filetypes=[("CSV files", "*.csv"), ("PDF report", "*.pdf")])
+        if not path:
+            return
+        runner.submit((str(win), "export"), analytics.export_report, path, shown["report"], shown["start"],
+                      shown["end"], shown["rows"], widget=win, metric="ui.analytics_export",
+                      on_done=lambda count: status.config(text=f"{count} row(s) exported to {path}"))
+
+    def reload():
+        state["after"] = None
+        load_report()
+
+    def on_invalidated(dates):
+        # Readings arrive in bursts during collection hours; reload at most once per REPORT_RELOAD_MS.
+        if shown and not state["after"] and analytics.covers(shown["start"], shown["end"], dates):
+            state["after"] = win.after(REPORT_RELOAD_MS, reload)
+    subscribe(win, analytics.reports, on_invalidated)
+
+    button_frame = ttk.Frame(control_frame, style='Card.TFrame')
+    button_frame.grid(row=1, column=0, columnspan=6, pady=15)
+    ttk.Button(button_frame, text="📊 Show Report", command=load_report,
+               style='Success.TButton').pack(side='left', padx=10)
+    ttk.Button(button_frame, text="📤 Export", command=export_report, style='Modern.TButton').pack(side='left', padx=10)
+    report_var.trace_add("write", load_report)
+    load_report()
+
+
+def main():
+    global root, runner, syncer, feed, watcher
+    try:
+        db.init_db()
+        offline = None
+    except psycopg2.OperationalError as ex:
+        # Server down at launch: readings still go to the local journal, and the
+        # schema, published charts and customers are picked up once it is back.
+        offline = str(ex).strip()
+    root = tk.Tk()
+    runner = BackgroundRunner(root)
+    syncer = journal.Syncer(journal.Journal())
+    if offline:
+        syncer.online, syncer.last_error = False, offline
+    syncer.start()
+    feed = changes.ChangeFeed()
+    feed.start()
+    watcher = rates.RateWatcher()
+    root.title("🥛 Modern Dairy Management")
+    root.geometry("700x720")
+    root.configure(bg='#1a1a2e')
+    style = ttk.Style()
+    style.theme_use('clam')
+    style.configure('Modern.TButton', font=('Segoe UI', 11, 'bold'), background=COLORS['primary'],foreground='white', relief='flat', padding=(20, 12))
+    style.configure('Success.TButton', background=COLORS['success'], foreground='white', padding=(15, 8))
+    style.configure('Danger.TButton', background=COLORS['danger'], foreground='white', padding=(15, 8))
+    style.configure('Card.TFrame', background=COLORS['bg_card'], relief='flat', borderwidth=2)
+    style.configure('Dark.TFrame', background=COLORS['bg_primary'], relief='flat')
+    style.configure('Title.TLabel', background=COLORS['bg_primary'], foreground=COLORS['text_primary'],font=('Segoe UI', 18, 'bold'))
+    style.configure('Card.TLabel', background=COLORS['bg_card'], foreground=COLORS['text_primary'])
+    style.configure('Modern.TEntry', fieldbackground='white', borderwidth=2, font=('Segoe UI', 10))
+    style.configure('Modern.TCombobox', fieldbackground='white', font=('Segoe UI', 10))
+    style.configure("Modern.Treeview.Heading", font=('Segoe UI', 10, 'bold'), background=COLORS['primary'],foreground='white', relief='flat')
+    style.configure("Modern.Treeview", background='white', fieldbackground='white')
+    try:
+        rates.ensure_loaded()
+    except FileNotFoundError:
+        messagebox.showwarning("CSV Missing", f"{rates.FAT_RATE_FILE} not found. Enter rates manually.")
+    # Started once the first chart is loaded; a revised fat_rate.csv or a newly published chart
+    # (or, after an offline start, every published chart) is picked up while the app runs.
+    watcher.start()
+
+    def charts_reloaded(book, error):
+        if error:
+            messagebox.showwarning("⚠️ Rate Chart", f"{error}\nThe previous chart is still in use.")
+
+    main_frame = ttk.Frame(root, style='Dark.TFrame', padding=40)
+    main_frame.pack(fill='both', expand=True)
+    ttk.Label(main_frame, text="🥛 Modern Dairy Management", style='Title.TLabel').pack(pady=(0, 10))
+    dashboard_label = ttk.Label(main_frame, text="", style='Title.TLabel', font=('Segoe UI', 11))
+    dashboard_label.pack(pady=(0, 20))
+
+    def show_dashboard(today):
+        dashboard_label.config(text=f"Today: {today['liters']:.1f} L · {today['readings']} readings · "
+                                    f"avg fat {today['avg_fat']:.2f}% · ₹{today['amount']:.2f}")
+
+    def show_offline(ex):
+        if ex is None or isinstance(ex, psycopg2.OperationalError):
+            dashboard_label.config(text=f"📴 Server unreachable · {sync_status()}")
+
+    def load_dashboard():
+        runner.submit("dashboard", aggregates.fetch_dashboard, on_done=show_dashboard, on_error=show_offline)
+
+    def refresh_dashboard():
+        load_dashboard()
+        root.after(60000, refresh_dashboard)
+
+    def setup_schema():
+        # Skipped at launch while the server was down; retried until it is reachable.
+        runner.submit("schema", db.init_db, on_done=lambda _: load_dashboard(),
+                      on_error=lambda ex: root.after(SCHEMA_RETRY_MS, setup_schema))
+    refresh_dashboard()
+    if offline:
+        show_offline(None)
+        root.after(SCHEMA_RETRY_MS, setup_schema)
+    runner.submit("customers", cache.customers.refresh, on_error=lambda ex: None)
+
+    def reports_changed(table, op, keys):
+        # Cached reports are recomputed on demand once a change touches their period.
+        if table == "milk_collection":
+            runner.submit(None, analytics.collections_changed, op, keys,
+                          on_error=lambda ex: analytics.reports.invalidate())
+        else:
+            analytics.reports.invalidate()
+
+    def customers_changed(table, op, keys):
+        # Session entry validates codes against the cache, so keep it current.
+        if table == "customers" and keys:
+            # Open customer directories are updated from this one re-read.
+            runner.submit(None, cache.customers.refresh_codes, keys, on_error=lambda ex: None,
+                          metric="ui.customers.refresh_codes")
+        elif table in (None, "customers"):
+            runner.submit("customers", cache.customers.refresh, True, on_error=lambda ex: None)
+    subscribe(root, feed, reports_changed)
+    subscribe(root, feed, customers_changed)
+    subscribe(root, watcher, charts_reloaded)
+    menu_buttons = [    ("👤 Customer Registration", open_customer_form, 'Success.TButton'),
+                        ("👥 Customer Directory", open_customer_list, 'Modern.TButton'),
+                        ("🥛 Milk Collection", open_collection_form, 'Modern.TButton'),
+                        ("🧾 Bill Generation", open_bill_form, 'Modern.TButton'),
+                        ("📊 Analytics", open_analytics, 'Modern.TButton'),
+                        ("📈 Diagnostics", open_diagnostics, 'Modern.TButton'),
+                        ("🚪 Exit", root.destroy, 'Danger.TButton') ]
+    for text, command, style in menu_buttons:
+        ttk.Button(main_frame, text=text, command=command, style=style).pack(fill='x', pady=8, padx=20)
+    try:
+        root.mainloop()
+    finally:
+        watcher.stop()
+        feed.stop()
+        syncer.stop()
+        syncer.journal.close()
+        runner.shutdown()
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
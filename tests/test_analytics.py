@@ -0,0 +1,27 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from dairy import analytics  # noqa: E402
+
+
+def test_format_value():
+    assert analytics.format_value(None) == ""
+    assert analytics.format_value(date(2025, 1, 2)) == "2025-01-02"
+    assert analytics.format_value(datetime(2025, 1, 2, 6, 30)) == "2025-01-02T06:30:00"
+    assert analytics.format_value(Decimal("12.346")) == "12.35"
+    assert analytics.format_value(Decimal("NaN")) == "NaN"
+    assert analytics.format_value(4.5) == "4.50"
+    assert analytics.format_value(7) == "7"
+    assert analytics.format_value("Morning") == "Morning"
+
+
+def test_covers():
+    start, end = date(2025, 1, 1), date(2025, 1, 15)
+    assert analytics.covers(start, end, None)
+    assert analytics.covers(start, end, [date(2025, 1, 15)])
+    assert not analytics.covers(start, end, [date(2024, 12, 31), date(2025, 1, 16)])
+    assert not analytics.covers(start, end, [])
@@ -0,0 +1,111 @@
+import math
+from datetime import date
+
+import pytest
+
+from dairy import rates
+
+
+def flat_chart(**kwargs):
+    # fat 3.0..8.0 in 0.1 steps at 10 per fat point, like fat_rate.csv.
+    return rates.RateChart.from_points([(3.0 + i / 10, None, 30 + i) for i in range(51)], **kwargs)
+
+
+def snf_chart(**kwargs):
+    return rates.RateChart.from_points([(fat, snf, fat * 10 + snf) for fat in (3.0, 3.5, 4.0)
+                                        for snf in (8.0, 8.5)], **kwargs)
+
+
+def test_nearest_point_lookup():
+    chart = flat_chart()
+    assert (chart.fat_min, chart.fat_step, chart.fat_count) == (3.0, 0.1, 51)
+    assert chart.lookup(5.0) == 50
+    assert chart.lookup(5.04) == 50
+    assert chart.lookup(5.06) == 51
+
+
+def test_nearest_point_takes_half_a_step_past_the_edges():
+    chart = flat_chart()
+    assert chart.lookup(8.04) == 80
+    assert chart.lookup(2.96) == 30
+    assert chart.lookup(8.06) is None
+    assert chart.lookup(2.94) is None
+
+
+def test_interpolated_lookup_stays_inside_the_chart():
+    chart = flat_chart(interpolate=True)
+    assert chart.lookup(3.05) == pytest.approx(30.5)
+    assert chart.lookup(8.0) == 80
+    assert chart.lookup(3.0) == 30
+    assert chart.lookup(8.04) is None
+    assert chart.lookup(2.96) is None
+
+
+def test_holes_price_as_missing():
+    points = [(3.0, None, 30), (3.1, None, 31), (3.3, None, 33)]
+    nearest = rates.RateChart.from_points(points)
+    assert nearest.lookup(3.2) is None
+    assert nearest.lookup(3.1) == 31
+    interpolated = rates.RateChart.from_points(points, interpolate=True)
+    assert interpolated.lookup(3.1) == 31
+    assert interpolated.lookup(3.3) == 33
+    assert interpolated.lookup(3.15) is None
+    assert interpolated.lookup(3.05) == pytest.approx(30.5)
+
+
+def test_snf_grid():
+    chart = snf_chart()
+    assert chart.snf_count == 2
+    assert chart.lookup(3.5, 8.5) == 43.5
+    assert chart.lookup(3.6, 8.1) == 43
+    assert chart.lookup(3.5) is None
+    assert chart.lookup(3.5, 9.0) is None
+    with pytest.raises(rates.RateError, match="needs an SNF reading"):
+        chart.rate(3.5)
+    interpolated = snf_chart(interpolate=True)
+    assert interpolated.lookup(3.25, 8.25) == pytest.approx(40.75)
+    assert interpolated.lookup(4.0, 8.5) == 48.5
+
+
+def test_rate_reports_the_covered_range():
+    with pytest.raises(rates.RateError, match="covers 3.0-8.0"):
+        flat_chart().rate(9.0)
+
+
+def test_chart_shape_is_checked():
+    with pytest.raises(rates.RateError):
+        rates.RateChart([30, 31], 3.0, 0.1, 3)
+    with pytest.raises(rates.RateError):
+        rates.RateChart.from_points([])
+
+
+def test_rate_book_picks_the_newest_effective_chart():
+    default = flat_chart(name="default")
+    old = flat_chart(animal_type="Cow", effective_from=date(2024, 1, 1), chart_id=1)
+    new = flat_chart(animal_type="Cow", effective_from=date(2024, 6, 1), chart_id=2)
+    book = rates.RateBook([old, new], default)
+    assert book.chart_for("Cow", date(2024, 3, 1)) is old
+    assert book.chart_for("Cow", date(2024, 7, 1)) is new
+    assert book.chart_for("Cow", date(2023, 7, 1)) is default
+    assert book.chart_for("Buffalo", date(2024, 7, 1)) is default
+
+
+def test_price_readings_returns_the_pricing_chart():
+    cow = flat_chart(animal_type="Cow", chart_id=7)
+    book = rates.RateBook([cow], snf_chart(name="default"))
+    prices, charts = book.price_readings([("Cow", None, 4.0, None), ("Buffalo", None, 3.5, 8.0),
+                                          ("Buffalo", None, 3.5, None)])
+    assert prices == [40, 43.0, None]
+    assert [c.version for c in charts] == ["chart 7", "default", "default"]
+
+
+def test_csv_chart_version_follows_its_content(tmp_path):
+    path = tmp_path / "fat_rate.csv"
+    path.write_text("Fat,Rate\n3.0,30\n3.1,31\n")
+    first = rates.load_chart_csv(str(path), name="fat_rate.csv")
+    path.write_text("Fat,Rate\n3.0,30\n3.1,32\n")
+    second = rates.load_chart_csv(str(path), name="fat_rate.csv")
+    assert first.version.startswith("fat_rate.csv@")
+    assert first.version != second.version
+    assert second.lookup(3.1) == 32
+    assert not math.isnan(second.rates[0])
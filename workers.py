@@ -0,0 +1,122 @@
+import itertools
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox, TclError
+
+from dairy import db, metrics
+
+
+# Runs database queries and PDF renders off the Tk thread. Work is keyed:
+# submitting again under the same key supersedes the earlier request, which is
+# cancelled if it has not started and otherwise has its result dropped. Results
+# come back to the Tk thread through a queue drained with root.after, since Tk
+# must only be touched from its own thread. The queue is polled for as long as
+# the runner lives: call_soon comes from syncer / change-feed threads that
+# cannot schedule Tk callbacks themselves.
+class BackgroundRunner:
+    def __init__(self, root, max_workers=None, poll_ms=50):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or db.POOL_MAX,
+                                            thread_name_prefix="dairy-worker")
+        self._events = queue.Queue()
+        # key -> generation of the latest request, until its result is delivered.
+        # Generations are unique across keys, so a key can be dropped once
+        # delivered without an older, superseded result matching a later request.
+        self._generations = {}
+        self._counter = itertools.count(1)
+        self._futures = {}
+        self._busy = {}
+        self._closed = False
+        self.root.after(self.poll_ms, self._poll)
+
+    def submit(self, key, fn, *args, on_done=None, on_error=None, widget=None, metric=None, **kwargs):
+        if key is None:
+            # Writes are never superseded or cancelled.
+            key = object()
+        generation = self._generations[key] = next(self._counter)
+        previous = self._futures.pop(key, None)
+        if previous is not None:
+            previous.cancel()
+        if widget is not None:
+            self._set_busy(widget, 1)
+        started = time.perf_counter()
+        future = self._executor.submit(fn, *args, **kwargs)
+        self._futures[key] = future
+        future.add_done_callback(lambda f: self._events.put(
+            (self._deliver, (key, generation, f, on_done, on_error, widget, metric, started))))
+        return future
+
+    def call_soon(self, fn, *args):
+        # Thread-safe: queue a callable to run on the Tk thread (e.g. progress updates).
+        self._events.put((fn, args))
+
+    def shutdown(self):
+        self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self):
+        try:
+            while True:
+                fn, args = self._events.get_nowait()
+                try:
+                    fn(*args)
+                except TclError:
+                    # The window that asked for this work has been closed.
+                    pass
+        except queue.Empty:
+            pass
+        if not self._closed:
+            try:
+                self.root.after(self.poll_ms, self._poll)
+            except TclError:
+                # The root window has been destroyed.
+                self._closed = True
+
+    def _deliver(self, key, generation, future, on_done, on_error, widget, metric, started):
+        if widget is not None:
+            self._set_busy(widget, -1)
+        if self._futures.get(key) is future:
+            del self._futures[key]
+        if self._generations.get(key) != generation:
+            return
+        del self._generations[key]
+        if future.cancelled():
+            return
+        if widget is not None and not _exists(widget):
+            return
+        error = future.exception()
+        if error is None:
+            # metric runs from the click until the result reaches the Tk thread;
+            # metric.render is the time spent applying it to the widgets.
+            delivered = time.perf_counter()
+            if metric:
+                metrics.record(metric, delivered - started, metrics.count_rows(future.result()))
+            if on_done:
+                on_done(future.result())
+            if metric:
+                metrics.record(metric + ".render", time.perf_counter() - delivered)
+            return
+        if metric:
+            metrics.record(metric, time.perf_counter() - started, error=True)
+        if on_error:
+            on_error(error)
+        else:
+            messagebox.showerror("❌ Error", str(error), parent=widget)
+
+    def _set_busy(self, widget, delta):
+        count = self._busy.get(widget, 0) + delta
+        if count > 0:
+            self._busy[widget] = count
+        else:
+            self._busy.pop(widget, None)
+        if _exists(widget):
+            widget.config(cursor="watch" if count > 0 else "")
+
+
+def _exists(widget):
+    try:
+        return bool(widget.winfo_exists())
+    except TclError:
+        return False